@@ -0,0 +1,128 @@
+import argparse
+from datetime import datetime
+import os
+import tempfile
+import time
+
+from .metadata_store import get_metadata_store
+from .mock_youtube_api import MockYouTubeAPI
+from .query_youtube_api import get_video_metadata
+
+
+def benchmark_crawler(nb_windows:int = 20,
+                      window_size_in_mins:int = 1800,
+                      videos_per_hour:float = 2.0,
+                      latency_secs:float = 0.05,
+                      error_rate:float = 0.0,
+                      missing_rate:float = 0.0,
+                      quota:int = None,
+                      max_concurrent_windows:int = 1,
+                      adaptive_window:bool = False,
+                      storage_backend:str = 'csv',
+                      ref_datetime:str = '2024-01-01T00:00:00') -> dict:
+    """
+    [Arguments]
+        nb_windows: number of windows to crawl
+        window_size_in_mins: size of the search window in minutes
+        videos_per_hour / latency_secs / error_rate / missing_rate / quota: behaviour of the mock API
+        max_concurrent_windows / adaptive_window / storage_backend: crawler options being benchmarked
+        ref_datetime: reference datetime to start the search from
+
+    [Returns]
+        dictionary of metrics:
+            - videos_per_sec: videos stored per second of wall time
+            - requests_per_video: API requests (search + videos) per stored video
+            - credits_per_video: quota credits spent per stored video
+            - mean_commit_secs / max_commit_secs: time spent merging a window into the store
+
+    [Explanation]
+        Runs get_video_metadata against a local MockYouTubeAPI in a temporary directory,
+        so that changes to the crawler can be measured without network access or an API key.
+    """
+
+    with tempfile.TemporaryDirectory() as temp_dir, MockYouTubeAPI(videos_per_hour=videos_per_hour,
+                                                                    latency_secs=latency_secs,
+                                                                    error_rate=error_rate,
+                                                                    missing_rate=missing_rate,
+                                                                    quota=quota) as api_base_url:
+
+        output_data_path = os.path.join(temp_dir, 'video_metadata.db' if storage_backend == 'sqlite' else 'video_metadata.csv')
+
+        start_time = time.perf_counter()
+        stats = get_video_metadata(
+            output_data_path=output_data_path,
+            output_completion_log_path=os.path.join(temp_dir, 'completion_results.csv'),
+            temp_dir_file_path=os.path.join(temp_dir, 'temp_dir'),
+            i_start=0,
+            i_end=nb_windows,
+            ref_datetime=ref_datetime,
+            window_size_in_mins=window_size_in_mins,
+            max_concurrent_windows=max_concurrent_windows,
+            adaptive_window=adaptive_window,
+            quota_budget=10**9,
+            quota_ledger_path=os.path.join(temp_dir, 'quota_ledger.json'),
+            checkpoint_path=os.path.join(temp_dir, 'crawl_checkpoint.json'),
+            storage_backend=storage_backend,
+            seen_index_path=os.path.join(temp_dir, 'seen_video_ids.csv'),
+            api_base_url=api_base_url,
+        )
+        wall_time = time.perf_counter() - start_time
+
+        store = get_metadata_store(storage_backend, output_data_path)
+        nb_videos = len(store.select())
+        store.close()
+
+    nb_requests = sum(counter['requests'] for counter in stats['counters'].values())
+    nb_search_requests = stats['counters'].get('search', {}).get('requests', 0)
+    nb_videos_requests = stats['counters'].get('videos', {}).get('requests', 0)
+    commit_times = stats['commit_times_secs']
+
+    return {
+        'nb_windows': stats['nb_windows'],
+        'nb_videos': nb_videos,
+        'wall_time_secs': wall_time,
+        'videos_per_sec': nb_videos / wall_time,
+        'requests_per_video': nb_requests / max(1, nb_videos),
+        'credits_per_video': (100 * nb_search_requests + nb_videos_requests) / max(1, nb_videos),
+        'mean_commit_secs': sum(commit_times) / max(1, len(commit_times)),
+        'max_commit_secs': max(commit_times, default=0.0),
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the crawler against a local mock of the YouTube Data API.')
+    parser.add_argument('--nb_windows', type=int, default=20, help='Number of windows to crawl')
+    parser.add_argument('--window_size_in_mins', type=int, default=1800, help='Size of the search window in minutes')
+    parser.add_argument('--videos_per_hour', type=float, default=2.0, help='Density of the fake corpus')
+    parser.add_argument('--latency_secs', type=float, default=0.05, help='Latency of every mock request')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Probability of a mock request failing with 503')
+    parser.add_argument('--missing_rate', type=float, default=0.0, help='Probability of a video being deleted/private')
+    parser.add_argument('--quota', type=int, default=None, help='Quota of the mock API in credits')
+    parser.add_argument('--max_concurrent_windows', type=int, nargs='+', default=[1], help='Numbers of concurrent windows to compare')
+    parser.add_argument('--adaptive_window', action='store_true', help='Adapt the window size to the density of the results')
+    parser.add_argument('--storage_backend', type=str, default='csv', choices=['csv', 'sqlite'], help='Storage backend of the metadata')
+    args = parser.parse_args()
+
+    results = []
+    for max_concurrent_windows in args.max_concurrent_windows:
+        metrics = benchmark_crawler(
+            nb_windows=args.nb_windows,
+            window_size_in_mins=args.window_size_in_mins,
+            videos_per_hour=args.videos_per_hour,
+            latency_secs=args.latency_secs,
+            error_rate=args.error_rate,
+            missing_rate=args.missing_rate,
+            quota=args.quota,
+            max_concurrent_windows=max_concurrent_windows,
+            adaptive_window=args.adaptive_window,
+            storage_backend=args.storage_backend,
+        )
+        results.append((max_concurrent_windows, metrics))
+
+    print(f'\n[Benchmark {datetime.now().strftime("%y-%m-%d-%H-%M-%S")}]')
+    for max_concurrent_windows, metrics in results:
+        print(f"concurrency={max_concurrent_windows} -- {metrics['nb_windows']} windows, {metrics['nb_videos']} videos in {metrics['wall_time_secs']:.2f} s -- "
+              f"{metrics['videos_per_sec']:.1f} videos/s, {metrics['requests_per_video']:.3f} requests/video, "
+              f"{metrics['credits_per_video']:.2f} credits/video, merge {metrics['mean_commit_secs'] * 1000:.1f} ms/window "
+              f"(max {metrics['max_commit_secs'] * 1000:.1f} ms)")
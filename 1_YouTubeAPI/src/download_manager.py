@@ -0,0 +1,359 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import csv
+from datetime import datetime
+import glob
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+
+from .metadata_store import STORAGE_BACKENDS, get_metadata_store
+
+
+# Same format selection as yt_dler.sh: H.264 video + m4a audio, or the best mp4
+YT_DLP_FORMAT = 'bv*[vcodec^=avc]+ba[ext=m4a]/b[ext=mp4]/b'
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class DownloadLedger():
+    """
+    Resumable record of the state of every video (queued, running, done, failed).
+
+    The ledger is a JSON file rewritten atomically after every change of state.
+    Videos left 'running' by an interrupted run are queued again on the next run.
+    """
+
+    def __init__(self, ledger_path:str):
+
+        self.ledger_path = ledger_path
+        self._lock = threading.Lock()
+
+        self.videos = {}
+        if os.path.exists(ledger_path):
+            with open(ledger_path, 'r', encoding='utf-8') as file:
+                self.videos = json.load(file)
+
+        for video in self.videos.values():
+            if video['state'] == RUNNING:
+                video['state'] = QUEUED
+
+    def add(self, video_id:str, url:str):
+        with self._lock:
+            if video_id not in self.videos:
+                self.videos[video_id] = {'url': url, 'state': QUEUED, 'attempts': 0, 'path': None, 'error': None, 'updated_at': None}
+
+    def to_download(self, max_attempts:int, video_ids:list = None) -> list:
+        """
+        Videos queued or to retry, among video_ids (None: every video of the ledger)
+        """
+        with self._lock:
+            if video_ids is None:
+                video_ids = self.videos.keys()
+            videos = [(video_id, self.videos[video_id]) for video_id in dict.fromkeys(video_ids) if video_id in self.videos]
+            return [video_id for video_id, video in videos
+                    if video['state'] == QUEUED or (video['state'] == FAILED and video['attempts'] < max_attempts)]
+
+    def update(self, video_id:str, state:str, **kwargs):
+        with self._lock:
+            video = self.videos[video_id]
+            video.update(kwargs, state=state, updated_at=datetime.now().isoformat())
+            if state == RUNNING:
+                video['attempts'] += 1
+            self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def summary(self) -> dict:
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for video in self.videos.values():
+                counts[video['state']] += 1
+            return counts
+
+    def _save(self):
+        temp_path = f'{self.ledger_path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.videos, file, indent=1)
+        os.replace(temp_path, self.ledger_path)
+
+
+class RateLimiter():
+    """
+    Spaces out the start of downloads from the same host by at least
+    min_interval_secs (plus up to jitter_secs), whatever the number of workers.
+    """
+
+    def __init__(self, min_interval_secs:float, jitter_secs:float = 0.0):
+        self.min_interval_secs = min_interval_secs
+        self.jitter_secs = jitter_secs
+        self._lock = threading.Lock()
+        self._next_start_time = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start_time = max(now, self._next_start_time)
+            self._next_start_time = start_time + self.min_interval_secs + random.uniform(0, self.jitter_secs)
+        time.sleep(start_time - now)
+
+
+def read_videos_to_download(storage_backend:str = None,
+                            output_data_path:str = None,
+                            input_csv_path:str = None,
+                            **filters) -> list:
+    """
+    [Returns]
+        list of (video_id, url) to download, either selected from the crawler's metadata store
+        (with the same filters as metadata_store.select) or read from a csv file in the
+        format of yt_dler.sh (nb, url, title)
+    """
+
+    if input_csv_path is not None:
+        with open(input_csv_path, 'r', newline='', encoding='UTF-8') as file:
+            urls = [row['url'] for row in csv.DictReader(file)]
+    else:
+        store = get_metadata_store(storage_backend, output_data_path)
+        urls = [row['URL'] for row in store.select(**filters)]
+        store.close()
+
+    return [(url.split('v=')[-1], url) for url in urls]
+
+
+def download_video(video_id:str, url:str, output_dir:str, limit_rate:str = '3.0M') -> str:
+    """
+    Downloads one video with yt-dlp and returns the path of the downloaded file
+    """
+
+    command = ['yt-dlp',
+               '--output', f'{output_dir}/{video_id}.%(ext)s',
+               '-f', YT_DLP_FORMAT,
+               '--no-progress']
+    if limit_rate is not None:
+        command += ['--limit-rate', limit_rate]
+    command.append(url)
+
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().split('\n')[-1])
+
+    paths = [path for path in glob.glob(f'{glob.escape(output_dir)}/{glob.escape(video_id)}.*')
+             if not path.endswith('.part') and not path.endswith('.ytdl')]
+    if len(paths) == 0:
+        raise RuntimeError(f'yt-dlp did not produce a file for {video_id}')
+    return paths[0]
+
+
+class ExtractionQueue():
+    """
+    File-based queue handing the downloaded videos over to the thumbnail extraction
+    (see extract_frames_from_queue in 3_FACT/src/thumbnails_extractor.py).
+
+        - {queue_path}: one video path per line, appended by the downloader,
+                        and END_OF_QUEUE once all the downloads are finished
+        - {queue_path}.done: one video path per line, appended by the extractor
+        - {queue_path}.failed: videos the extractor could not process (no longer pending)
+
+    Back-pressure: a download only starts once fewer than max_pending videos are waiting
+    for (or undergoing) extraction, downloads in progress included. With the extractor
+    deleting the videos it has processed, disk usage stays at about max_pending videos
+    instead of the whole corpus.
+
+    [Arguments]
+        queue_path: filepath to the queue file
+        max_pending: maximum number of videos downloaded but not extracted yet (None: unbounded)
+        poll_secs: time between two checks of the progress of the extractor
+    """
+
+    END_OF_QUEUE = '__END__'
+
+    def __init__(self, queue_path:str, max_pending:int = None, poll_secs:float = 5.0):
+
+        self.queue_path = queue_path
+        self.done_path = f'{queue_path}.done'
+        self.failed_path = f'{queue_path}.failed'
+        self.max_pending = max_pending
+        self.poll_secs = poll_secs
+
+        self._lock = threading.Lock()
+        self._reserved = 0
+
+        # A queue closed by a previous run is opened again
+        if os.path.exists(queue_path):
+            lines = _read_lines(queue_path)
+            if self.END_OF_QUEUE in lines:
+                with open(queue_path, 'w', encoding='utf-8') as file:
+                    file.writelines(f'{line}\n' for line in lines if line != self.END_OF_QUEUE)
+
+    def pending(self) -> int:
+        processed = set(_read_lines(self.done_path)) | set(_read_lines(self.failed_path))
+        return len(set(_read_lines(self.queue_path)) - processed)
+
+    def reserve(self):
+        """
+        Blocks until there is room for one more video
+        """
+
+        while True:
+            with self._lock:
+                if self.max_pending is None or self.pending() + self._reserved < self.max_pending:
+                    self._reserved += 1
+                    return
+            time.sleep(self.poll_secs)
+
+    def release(self):
+        with self._lock:
+            self._reserved -= 1
+
+    def put(self, path:str):
+        # Absolute, as the extractor runs from another directory
+        with self._lock:
+            with open(self.queue_path, 'a', encoding='utf-8') as file:
+                file.write(f'{os.path.abspath(path)}\n')
+            self._reserved -= 1
+
+    def close(self):
+        with self._lock:
+            with open(self.queue_path, 'a', encoding='utf-8') as file:
+                file.write(f'{self.END_OF_QUEUE}\n')
+
+
+def _read_lines(path:str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as file:
+        return [line.strip() for line in file if line.strip() != '']
+
+
+def download_videos(videos:list,
+                    output_dir:str,
+                    ledger_path:str,
+                    num_workers:int = 2,
+                    min_start_interval_secs:float = 70.0,
+                    start_jitter_secs:float = 10.0,
+                    limit_rate:str = '3.0M',
+                    max_attempts:int = 3,
+                    on_video_done = None,
+                    extraction_queue:ExtractionQueue = None) -> dict:
+    """
+    [Arguments]
+        videos: list of (video_id, url) to download
+        output_dir: directory to save the videos in (as {video_id}.{ext})
+        ledger_path: filepath to the JSON ledger of the state of every video
+        num_workers: number of yt-dlp processes running at the same time
+        min_start_interval_secs: minimum time between the start of two downloads (all workers included)
+        start_jitter_secs: random time added to min_start_interval_secs
+        limit_rate: download rate limit of every yt-dlp process (None: no limit)
+        max_attempts: number of attempts before a video is left as failed
+        on_video_done: function called with (video_id, path) once a video is downloaded
+        extraction_queue: queue handing the downloaded videos over to the thumbnail extraction,
+                          with back-pressure (see ExtractionQueue)
+
+    [Returns]
+        number of videos per state
+
+    [Explanation]
+        yt_dler.sh downloads one video at a time and sleeps 70-80 s after each download.
+        Here, a bounded pool of yt-dlp workers downloads several videos at once, while the
+        rate limiter keeps the same spacing between the *starts* of the downloads, so the
+        load on YouTube stays the same but the sleeps overlap with the downloads.
+        The ledger makes the downloads resumable: done videos are skipped on the next run,
+        and failed ones are retried up to max_attempts (only among the given videos).
+
+        With an extraction_queue, every video is handed over to the thumbnail extraction as soon
+        as it is downloaded, so that downloads and extraction overlap.
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    ledger = DownloadLedger(ledger_path)
+    for video_id, url in videos:
+        ledger.add(video_id, url)
+    ledger.save()
+
+    rate_limiter = RateLimiter(min_start_interval_secs, start_jitter_secs)
+
+    def worker(video_id):
+        if extraction_queue is not None:
+            extraction_queue.reserve()
+        rate_limiter.wait()
+        ledger.update(video_id, RUNNING)
+        print(f'↓ {video_id} -- started at {datetime.now().strftime("%y-%m-%d-%H-%M-%S")}')
+        try:
+            path = download_video(video_id, ledger.videos[video_id]['url'], output_dir, limit_rate)
+        except Exception as error:
+            ledger.update(video_id, FAILED, error=str(error))
+            print(f'x {video_id} -- {error}')
+            if extraction_queue is not None:
+                extraction_queue.release()
+            return
+        ledger.update(video_id, DONE, path=path, error=None)
+        print(f'√ {video_id} -- {path}')
+        if extraction_queue is not None:
+            extraction_queue.put(path)
+        if on_video_done is not None:
+            on_video_done(video_id, path)
+
+    # Only the videos selected for this run (the ledger also holds those of previous selections)
+    video_ids = ledger.to_download(max_attempts, [video_id for video_id, _ in videos])
+    print(f'{len(video_ids)} videos to download -- {ledger.summary()}')
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        list(executor.map(worker, video_ids))
+
+    if extraction_queue is not None:
+        extraction_queue.close()
+
+    summary = ledger.summary()
+    print(f'Downloads finished -- {summary}')
+    return summary
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Download the videos selected from the metadata store with a pool of yt-dlp workers.')
+    parser.add_argument('--output_dir', type=str, required=True, help='Directory to save the videos in')
+    parser.add_argument('--ledger_path', type=str, default='data/download_ledger.json', help='Filepath to the JSON ledger of the downloads')
+    parser.add_argument('--storage_backend', type=str, default='csv', choices=list(STORAGE_BACKENDS.keys()), help='Storage backend of the metadata')
+    parser.add_argument('--output_data_path', type=str, default='data/video_metadata.csv', help='Filepath to the metadata store')
+    parser.add_argument('--input_csv_path', type=str, default=None, help='CSV file in the format of yt_dler.sh (nb, url, title), used instead of the metadata store')
+    parser.add_argument('--min_duration', type=float, default=None, help='Minimum duration of the videos in seconds')
+    parser.add_argument('--max_duration', type=float, default=None, help='Maximum duration of the videos in seconds')
+    parser.add_argument('--published_after', type=str, default=None, help='Earliest publication date (e.g. 2020-01-01T00:00:00Z)')
+    parser.add_argument('--published_before', type=str, default=None, help='Latest publication date (e.g. 2021-01-01T00:00:00Z)')
+    parser.add_argument('--channel_name', type=str, default=None, help='Name of the channel')
+    parser.add_argument('--num_workers', type=int, default=2, help='Number of downloads running at the same time')
+    parser.add_argument('--min_start_interval_secs', type=float, default=70.0, help='Minimum time between the start of two downloads')
+    parser.add_argument('--start_jitter_secs', type=float, default=10.0, help='Random time added to the interval between two downloads')
+    parser.add_argument('--limit_rate', type=str, default='3.0M', help='Download rate limit of every yt-dlp process')
+    parser.add_argument('--max_attempts', type=int, default=3, help='Number of attempts before a video is left as failed')
+    parser.add_argument('--extraction_queue_path', type=str, default=None, help='File to append the path of every downloaded video to (for the thumbnail extraction)')
+    parser.add_argument('--max_pending_extractions', type=int, default=None, help='Maximum number of downloaded videos waiting for extraction')
+    args = parser.parse_args()
+
+    videos = read_videos_to_download(
+        storage_backend=args.storage_backend,
+        output_data_path=args.output_data_path,
+        input_csv_path=args.input_csv_path,
+        min_duration=args.min_duration,
+        max_duration=args.max_duration,
+        published_after=args.published_after,
+        published_before=args.published_before,
+        channel_name=args.channel_name
+    )
+
+    download_videos(
+        videos=videos,
+        output_dir=args.output_dir,
+        ledger_path=args.ledger_path,
+        num_workers=args.num_workers,
+        min_start_interval_secs=args.min_start_interval_secs,
+        start_jitter_secs=args.start_jitter_secs,
+        limit_rate=args.limit_rate,
+        max_attempts=args.max_attempts,
+        extraction_queue=ExtractionQueue(args.extraction_queue_path, args.max_pending_extractions) if args.extraction_queue_path is not None else None
+    )
@@ -0,0 +1,330 @@
+import argparse
+import csv
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import sqlite3
+import threading
+
+
+HEADERS = ['i', 'video_id', 'URL', 'channel_name', 'title', 'published_date', 'duration', 'view_count', 'like_count', 'comment_count', 'description']
+
+
+class CSVMetadataStore():
+    """
+    Stores the video metadata in a single csv file (one row per video and per crawl).
+
+    Windows are committed by appending their rows, which is made atomic with a small journal:
+        1. append() writes the size of the csv file to the journal, then appends the rows
+        2. the caller writes the window to the completion log
+        3. mark_committed() removes the journal
+    Every step is fsynced. If the crawl is killed before 3., recover() truncates the csv file
+    back to its size in the journal on the next run.
+
+    Selections have to scan the whole file, see SQLiteMetadataStore for large crawls.
+    """
+
+    def __init__(self, output_data_path:str):
+
+        self.output_data_path = output_data_path
+        self.journal_path = f'{output_data_path}.journal'
+
+        # Check if output file exists
+        if os.path.exists(output_data_path) == False:
+            with open(output_data_path, mode='w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(HEADERS)
+
+    def append(self, i:int, rows:list):
+
+        # 1. Journal
+        with open(self.journal_path, 'w', encoding='utf-8') as file:
+            json.dump({'i': i, 'size': os.path.getsize(self.output_data_path)}, file)
+            fsync(file)
+
+        # 2. Append to main file
+        with open(self.output_data_path, 'a', newline='', encoding='UTF-8') as file:
+            writer = csv.writer(file)
+            writer.writerows(rows)
+            fsync(file)
+
+    def mark_committed(self, i:int):
+        os.remove(self.journal_path)
+
+    def recover(self, last_value_of_i:int):
+        """
+        Rolls back the rows of a commit that was interrupted before reaching the completion log
+        """
+
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path, 'r', encoding='utf-8') as file:
+            journal = json.load(file)
+
+        if journal['i'] > last_value_of_i:
+            print(f"Rolling back the interrupted commit of window {journal['i']}")
+            with open(self.output_data_path, 'r+b') as file:
+                file.truncate(journal['size'])
+                fsync(file)
+        os.remove(self.journal_path)
+
+    def select(self,
+               min_duration:float = None,
+               max_duration:float = None,
+               published_after:str = None,
+               published_before:str = None,
+               channel_name:str = None) -> list:
+        """
+        Returns the rows (as dictionaries) matching all the given filters,
+        keeping only the latest row of every video_id
+        """
+
+        videos = {}
+        with open(self.output_data_path, 'r', newline='', encoding='UTF-8') as file:
+            for row in csv.DictReader(file):
+                if _matches(row, min_duration, max_duration, published_after, published_before, channel_name):
+                    videos[row['video_id']] = row
+                else:
+                    videos.pop(row['video_id'], None)
+        return sorted(videos.values(), key=lambda row: row['published_date'])
+
+    def close(self):
+        pass
+
+
+class SQLiteMetadataStore():
+    """
+    Stores the video metadata in a SQLite database keyed by video_id.
+
+    Rows are upserted, so videos returned by overlapping windows (or by a later crawl)
+    are stored once, with their latest statistics. duration, published_date and channel_name
+    are indexed, so the usual selections do not need to scan the whole crawl.
+
+    A window is committed in a single transaction. Upserts are idempotent, so a window that
+    was committed but not written to the completion log is simply upserted again on the next run.
+    """
+
+    def __init__(self, output_data_path:str):
+
+        self.output_data_path = output_data_path
+        self.connection = sqlite3.connect(output_data_path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS videos (
+                    video_id TEXT PRIMARY KEY,
+                    i INTEGER,
+                    URL TEXT,
+                    channel_name TEXT,
+                    title TEXT,
+                    published_date TEXT,
+                    duration REAL,
+                    view_count INTEGER,
+                    like_count INTEGER,
+                    comment_count INTEGER,
+                    description TEXT
+                )''')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS videos_duration ON videos (duration)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS videos_published_date ON videos (published_date)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS videos_channel_name ON videos (channel_name)')
+
+    def append(self, i:int, rows:list):
+        columns = ', '.join(HEADERS)
+        placeholders = ', '.join('?' for _ in HEADERS)
+        updates = ', '.join(f'{column}=excluded.{column}' for column in HEADERS if column != 'video_id')
+        with self.connection:
+            self.connection.executemany(
+                f'INSERT INTO videos ({columns}) VALUES ({placeholders}) ON CONFLICT(video_id) DO UPDATE SET {updates}',
+                [_typed_row(row) for row in rows])
+
+    def mark_committed(self, i:int):
+        pass
+
+    def recover(self, last_value_of_i:int):
+        pass
+
+    def select(self,
+               min_duration:float = None,
+               max_duration:float = None,
+               published_after:str = None,
+               published_before:str = None,
+               channel_name:str = None) -> list:
+        """
+        Returns the rows (as dictionaries) matching all the given filters
+        """
+
+        conditions, parameters = [], []
+        for condition, parameter in [('duration >= ?', min_duration),
+                                     ('duration <= ?', max_duration),
+                                     ('published_date >= ?', published_after),
+                                     ('published_date <= ?', published_before),
+                                     ('channel_name = ?', channel_name)]:
+            if parameter is not None:
+                conditions.append(condition)
+                parameters.append(parameter)
+        where = f"WHERE {' AND '.join(conditions)}" if len(conditions) > 0 else ''
+
+        cursor = self.connection.execute(f'SELECT {", ".join(HEADERS)} FROM videos {where} ORDER BY published_date', parameters)
+        return [dict(zip(HEADERS, row)) for row in cursor]
+
+    def close(self):
+        self.connection.close()
+
+
+class SeenVideoIndex():
+    """
+    Persistent set of the video IDs that are already in the metadata store.
+
+    Neighbouring windows and re-runs often return the same videos. The index is loaded
+    at startup, and the details of known videos are not requested again (saving quota and
+    a duplicated row), unless they were fetched more than refresh_ttl ago.
+
+    The index is an append-only csv file of (video_id, fetched_at) rows, loaded into an exact
+    in-memory dictionary (a few hundred thousand IDs take a few tens of MB, so a probabilistic
+    structure such as a bloom filter is not needed). IDs are claimed in memory when their details
+    are requested, so concurrent windows do not fetch the same video twice, and are only written
+    to the file once their window is committed to the store.
+
+    [Arguments]
+        index_path: filepath to the csv file of the index
+        refresh_ttl: videos fetched longer ago than refresh_ttl are fetched again (None: never)
+    """
+
+    def __init__(self, index_path:str, refresh_ttl:timedelta = None):
+
+        self.index_path = index_path
+        self.refresh_ttl = refresh_ttl
+        self._lock = threading.Lock()
+
+        self.fetched_at = {}
+        if os.path.exists(index_path):
+            with open(index_path, 'r', newline='', encoding='UTF-8') as file:
+                reader = csv.reader(file)
+                next(reader)  # Skip the header row
+                for video_id, fetched_at in reader:
+                    self.fetched_at[video_id] = datetime.fromisoformat(fetched_at)
+        else:
+            with open(index_path, 'w', newline='', encoding='UTF-8') as file:
+                writer = csv.writer(file)
+                writer.writerow(['video_id', 'fetched_at'])
+
+    def __len__(self):
+        return len(self.fetched_at)
+
+    def seed(self, store):
+        """
+        Adds the videos of an existing store (e.g. a store created before the index)
+        """
+        self.record([row['video_id'] for row in store.select()])
+
+    def claim_unseen(self, video_ids:list) -> list:
+        """
+        Returns the video IDs whose details have to be requested, and claims them
+        """
+
+        now = datetime.now(timezone.utc)
+        unseen_video_ids = []
+        with self._lock:
+            for video_id in video_ids:
+                fetched_at = self.fetched_at.get(video_id)
+                if fetched_at is None or (self.refresh_ttl is not None and now - fetched_at > self.refresh_ttl):
+                    self.fetched_at[video_id] = now
+                    unseen_video_ids.append(video_id)
+        return unseen_video_ids
+
+    def record(self, video_ids:list):
+        """
+        Persists video IDs that were committed to the store
+        """
+
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            with open(self.index_path, 'a', newline='', encoding='UTF-8') as file:
+                writer = csv.writer(file)
+                for video_id in video_ids:
+                    fetched_at = self.fetched_at.setdefault(video_id, now)
+                    writer.writerow([video_id, fetched_at.isoformat()])
+                fsync(file)
+
+
+STORAGE_BACKENDS = {
+    'csv': CSVMetadataStore,
+    'sqlite': SQLiteMetadataStore,
+}
+
+
+def get_metadata_store(storage_backend:str, output_data_path:str):
+    if storage_backend not in STORAGE_BACKENDS:
+        raise ValueError(f'storage_backend has to be one of {list(STORAGE_BACKENDS.keys())}')
+    return STORAGE_BACKENDS[storage_backend](output_data_path)
+
+
+def export_download_list(store, output_csv_path:str, **filters):
+    """
+    Writes the selected videos in the format expected by yt_dler.sh (nb, url, title)
+    """
+
+    rows = store.select(**filters)
+    with open(output_csv_path, 'w', newline='', encoding='UTF-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['nb', 'url', 'title'])
+        for nb, row in enumerate(rows):
+            writer.writerow([nb, row['URL'], row['title']])
+
+    return len(rows)
+
+
+def fsync(file):
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def _typed_row(row:list) -> list:
+    row = [None if value == '' else value for value in row]
+    row[0] = int(row[0])
+    row[6] = None if row[6] is None else float(row[6])
+    for column in [7, 8, 9]:
+        row[column] = None if row[column] is None else int(row[column])
+    return row
+
+
+def _matches(row:dict, min_duration, max_duration, published_after, published_before, channel_name) -> bool:
+    duration = float(row['duration'])
+    if min_duration is not None and duration < min_duration:
+        return False
+    if max_duration is not None and duration > max_duration:
+        return False
+    if published_after is not None and row['published_date'] < published_after:
+        return False
+    if published_before is not None and row['published_date'] > published_before:
+        return False
+    if channel_name is not None and row['channel_name'] != channel_name:
+        return False
+    return True
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Select videos from the metadata store and write the list of videos to download.')
+    parser.add_argument('--storage_backend', type=str, default='csv', choices=list(STORAGE_BACKENDS.keys()), help='Storage backend of the metadata')
+    parser.add_argument('--output_data_path', type=str, default='data/video_metadata.csv', help='Filepath to the metadata store')
+    parser.add_argument('--output_csv_path', type=str, default='videos_to_download.csv', help='Filepath to the CSV file of videos to download (nb, url, title)')
+    parser.add_argument('--min_duration', type=float, default=None, help='Minimum duration of the videos in seconds')
+    parser.add_argument('--max_duration', type=float, default=None, help='Maximum duration of the videos in seconds')
+    parser.add_argument('--published_after', type=str, default=None, help='Earliest publication date (e.g. 2020-01-01T00:00:00Z)')
+    parser.add_argument('--published_before', type=str, default=None, help='Latest publication date (e.g. 2021-01-01T00:00:00Z)')
+    parser.add_argument('--channel_name', type=str, default=None, help='Name of the channel')
+    args = parser.parse_args()
+
+    store = get_metadata_store(args.storage_backend, args.output_data_path)
+    nb_videos = export_download_list(
+        store,
+        args.output_csv_path,
+        min_duration=args.min_duration,
+        max_duration=args.max_duration,
+        published_after=args.published_after,
+        published_before=args.published_before,
+        channel_name=args.channel_name
+    )
+    store.close()
+    print(f'{nb_videos} videos written to {args.output_csv_path}')
@@ -0,0 +1,197 @@
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+
+# Videos are published at regular intervals since this date
+EPOCH = datetime(2005, 4, 23, tzinfo=timezone.utc)
+
+
+class MockYouTubeAPI():
+    """
+    Local stand-in for the search and videos endpoints of the YouTube Data API v3,
+    to measure and regression-test the crawler without network access or an API key.
+
+    The fake corpus is deterministic: one video is published every 60 / videos_per_hour
+    minutes since EPOCH, so overlapping windows (and repeated crawls) return the same IDs.
+
+    [Arguments]
+        videos_per_hour: density of the fake corpus
+        latency_secs: latency added to every request
+        max_pages: number of search pages accessible per search (10 on the real API)
+        error_rate: probability of answering a request with error_status
+        error_status: status code of the injected errors (e.g. 429 or 503)
+        missing_rate: probability that a video is absent from the videos endpoint (deleted/private)
+        quota: number of credits before every request is answered with 403 quotaExceeded (None: unlimited)
+        seed: seed of the random error injection
+    """
+
+    def __init__(self,
+                 videos_per_hour:float = 1.0,
+                 latency_secs:float = 0.0,
+                 max_pages:int = 10,
+                 error_rate:float = 0.0,
+                 error_status:int = 503,
+                 missing_rate:float = 0.0,
+                 quota:int = None,
+                 seed:int = 0):
+
+        self.videos_per_hour = videos_per_hour
+        self.latency_secs = latency_secs
+        self.max_pages = max_pages
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.missing_rate = missing_rate
+        self.quota = quota
+        self.random = random.Random(seed)
+
+        self._lock = threading.Lock()
+        self.spent = 0
+        self.counters = {'search': 0, 'videos': 0, 'errors': 0}
+        self.server = None
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~#
+    #         Server          #
+    #~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    def start(self) -> str:
+        """
+        Starts the server on a free local port and returns the base URL to give to YouTubeClient
+        """
+
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                status, body = mock.handle(url.path.rsplit('/', 1)[-1], params)
+                content = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self.server.server_address[1]}/youtube/v3'
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~#
+    #        Endpoints        #
+    #~~~~~~~~~~~~~~~~~~~~~~~~~#
+
+    def handle(self, endpoint:str, params:dict):
+        """
+        Returns (status code, JSON body) of a request
+        """
+
+        time.sleep(self.latency_secs)
+
+        if endpoint not in ['search', 'videos']:
+            return 404, _error(404, 'notFound')
+
+        with self._lock:
+            self.counters[endpoint] += 1
+
+            # Failed requests are charged as well
+            cost = 100 if endpoint == 'search' else 1
+            if self.quota is not None and self.spent + cost > self.quota:
+                self.counters['errors'] += 1
+                return 403, _error(403, 'quotaExceeded')
+            self.spent += cost
+
+            if self.random.random() < self.error_rate:
+                self.counters['errors'] += 1
+                reason = 'rateLimitExceeded' if self.error_status in [403, 429] else 'backendError'
+                return self.error_status, _error(self.error_status, reason)
+
+        if endpoint == 'search':
+            return 200, self.search(params)
+        return 200, self.videos(params)
+
+    def search(self, params:dict) -> dict:
+
+        # Slots of the videos published within the window
+        slot_minutes = 60 / self.videos_per_hour
+        start = _to_minutes(params['publishedAfter']) / slot_minutes
+        end = _to_minutes(params['publishedBefore']) / slot_minutes
+        slots = list(range(math.ceil(start), math.ceil(end)))
+        total_results = len(slots)
+
+        # Only max_pages pages are accessible
+        max_results = int(params.get('maxResults', 5))
+        offset = int(params.get('pageToken', 0))
+        slots = slots[:self.max_pages * max_results]
+        page_slots = slots[offset:offset + max_results]
+
+        results = {
+            'kind': 'youtube#searchListResponse',
+            'pageInfo': {'totalResults': total_results, 'resultsPerPage': max_results},
+            'items': [{'id': {'kind': 'youtube#video', 'videoId': _video_id(slot)}} for slot in page_slots],
+        }
+        if offset + max_results < len(slots):
+            results['nextPageToken'] = str(offset + max_results)
+        return results
+
+    def videos(self, params:dict) -> dict:
+
+        items = []
+        for video_id in params['id'].split(','):
+            slot = _slot(video_id)
+            if random.Random(slot).random() < self.missing_rate:
+                continue
+            published_date = EPOCH.timestamp() + slot * 3600 / self.videos_per_hour
+            items.append({
+                'id': video_id,
+                'snippet': {
+                    'channelTitle': f'channel_{slot % 97}',
+                    'title': f'Wayang Kulit {slot}',
+                    'publishedAt': datetime.fromtimestamp(published_date, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'description': f'Pagelaran wayang kulit {slot}',
+                },
+                'contentDetails': {'duration': f'PT{1 + slot % 8}H{slot % 60}M'},
+                'statistics': {'viewCount': str(slot * 7 % 100000), 'likeCount': str(slot % 1000)},
+            })
+
+        return {'kind': 'youtube#videoListResponse', 'pageInfo': {'totalResults': len(items), 'resultsPerPage': len(items)}, 'items': items}
+
+
+def _to_minutes(rfc3339:str) -> float:
+    date = datetime.fromisoformat(rfc3339.replace('Z', '+00:00'))
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return (date - EPOCH).total_seconds() / 60
+
+
+def _video_id(slot:int) -> str:
+    return f'mock{slot:07d}'
+
+
+def _slot(video_id:str) -> int:
+    return int(video_id[len('mock'):])
+
+
+def _error(status:int, reason:str) -> dict:
+    return {'error': {'code': status, 'message': reason, 'errors': [{'reason': reason}]}}
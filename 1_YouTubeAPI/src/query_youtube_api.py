@@ -1,17 +1,334 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import csv
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import glob
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 import isodate
 import json
 import os
-import pandas as pd
-import requests
+import time
 import yaml
 
+from .metadata_store import HEADERS, SeenVideoIndex, fsync, get_metadata_store
+from .quota import QuotaBudgetExhausted, QuotaLedger
+from .youtube_client import API_BASE_URL, YouTubeClient
+
+
+MAX_IDS_PER_VIDEOS_REQUEST = 50
+
+
+def parse_video_details(item:dict) -> list:
+    """
+    [Arguments]
+        item: a single entry of the 'items' list returned by the videos endpoint
+
+    [Returns]
+        list of [video_id, URL, channel_name, title, published_date, duration,
+                 view_count, like_count, comment_count, description]
+    """
+
+    id = item['id']
+    channel_name = item['snippet']['channelTitle']
+    title = item['snippet']['title']
+
+    # Statistics may be hidden by the uploader
+    statistics = item.get('statistics', {})
+    view_count = statistics.get('viewCount')
+    like_count = statistics.get('likeCount')
+    comment_count = statistics.get('commentCount')
+
+    duration = isodate.parse_duration(item['contentDetails']['duration']).total_seconds()
+    published_date = item['snippet']['publishedAt']
+    description = item['snippet']['description']
+
+    return [id, f'https://www.youtube.com/watch?v={id}', channel_name, title, published_date, duration, view_count, like_count, comment_count, description]
+
+
+def get_video_details(video_ids:list, client:YouTubeClient) -> dict:
+    """
+    [Arguments]
+        video_ids: list of YouTube video IDs
+        client: YouTubeClient shared by the whole crawl
+
+    [Returns]
+        dictionary mapping video_id -> parsed video details (see parse_video_details)
+
+    [Explanation]
+        The videos endpoint accepts a comma-separated list of up to 50 IDs, and
+        a request costs 1 credit regardless of the number of IDs.
+        A full search page (50 results) is therefore resolved in a single call.
+
+        IDs of deleted or private videos are silently dropped by the API,
+        so they are simply absent from the returned dictionary.
+    """
+
+    video_details_dict = {}
+    for batch_start in range(0, len(video_ids), MAX_IDS_PER_VIDEOS_REQUEST):
+        batch_ids = video_ids[batch_start:batch_start + MAX_IDS_PER_VIDEOS_REQUEST]
+        params = {
+            'id'  : ','.join(batch_ids),
+            'part': 'contentDetails,snippet,statistics'}
+        results = client.videos(params)
+
+        # Map results back by ID (the order of the response is not guaranteed)
+        for item in results.get('items', []):
+            video_details_dict[item['id']] = parse_video_details(item)
+
+    return video_details_dict
+
+
+COMPLETION_LOG_HEADERS = ['i', 'completed_datetime','window_start_datetime', 'window_end_datetime', 'nb_videos', 'window_size_in_mins']
+
+# A search only gives access to 10 pages x 50 results
+MAX_RESULTS_PER_SEARCH = 500
+
+
+QUERY_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_config.yaml')
+
+# Parameters that change with every search request
+PER_REQUEST_PARAMETERS = ['pageToken', 'publishedAfter', 'publishedBefore']
+
+
+def compile_search_template(query_config_path:str = QUERY_CONFIG_PATH) -> dict:
+    """
+    [Arguments]
+        query_config_path: filepath to the YAML file of search parameters
+
+    [Returns]
+        dictionary of the fixed search parameters, reused by every search request
+        (only pageToken, publishedAfter and publishedBefore are added per request)
+
+    [Explanation]
+        The configuration is parsed and validated once per crawl instead of once per page.
+    """
+
+    with open(query_config_path, "r", encoding='utf-8') as f:
+        yaml_dict = yaml.safe_load(f)
+
+    # The placeholders of the per-request parameters and empty parameters are left out
+    search_template = {key: value for key, value in yaml_dict.items()
+                       if key not in PER_REQUEST_PARAMETERS and value not in ('', None, 'None')}
+
+    # Validation
+    for key in ['part', 'q']:
+        if key not in search_template:
+            raise ValueError(f'{query_config_path} is missing the search parameter {key}')
+    if search_template.get('type') != 'video':
+        raise ValueError(f'{query_config_path} must search for videos only (type: video)')
+    if not 0 < int(search_template.get('maxResults', 5)) <= 50:
+        raise ValueError(f'maxResults in {query_config_path} has to be between 1 and 50')
+
+    return search_template
+
+
+def search_page(client:YouTubeClient,
+                search_template:dict,
+                datetime_aft:datetime,
+                datetime_bef:datetime,
+                pageToken:str = '') -> dict:
+    """
+    Returns one page of search results for the window [datetime_aft, datetime_bef]
+    """
+
+    search_params = dict(search_template,
+                         publishedAfter=datetime_aft.isoformat() + 'Z',
+                         publishedBefore=datetime_bef.isoformat() + 'Z')
+    if pageToken != '':
+        search_params['pageToken'] = pageToken
+
+    return client.search(search_params)
+
+
+def crawl_window(client:YouTubeClient,
+                 search_template:dict,
+                 window:dict,
+                 temp_dir_file_path:str,
+                 first_search_results:dict = None,
+                 seen_index:SeenVideoIndex = None):
+    """
+    [Arguments]
+        client: YouTubeClient shared by the whole crawl
+        search_template: fixed search parameters (see compile_search_template)
+        window: state of the window (see new_window), updated in place after every page
+        temp_dir_file_path: filepath to save backup files
+        first_search_results: first search page of the window, if it was already requested
+        seen_index: index of the videos already in the store, whose details are not requested again
+
+    [Explanation]
+        Goes through every search page of the window and writes the details of the videos
+        into one {local_metadata_i={i}_page={page}} csv file per page.
+        Windows are independent of each other, so several windows can be crawled at once.
+
+        The window's page_token/page_count/nb_videos are only updated once a page is written,
+        so if the crawl stops (e.g. QuotaBudgetExhausted) the window resumes from the exact page.
+    """
+
+    i = window['i']
+
+    while True:
+
+        # 1. Obtain the list of YouTube videos with 'wayang kulit'
+        if window['page_count'] == 0 and first_search_results is not None:
+            search_results = first_search_results
+        else:
+            search_results = search_page(client, search_template, window['datetime_aft'], window['datetime_bef'], window['page_token'])
+
+        # 2. Get the details of every (new) video on the page in a single batched request
+        video_ids = [video_details['id']['videoId'] for video_details in search_results['items']]
+        if seen_index is not None:
+            video_ids = seen_index.claim_unseen(video_ids)
+        video_details_dict = get_video_details(video_ids, client) if len(video_ids) > 0 else {}
+
+        rows = []
+        for video_id in video_ids:
+
+            # Deleted or private videos are absent from the details response
+            if video_id not in video_details_dict:
+                print(f'x {i} -- Video {video_id} has no details (deleted or private), skipping')
+                continue
+            rows.append([i] + video_details_dict[video_id])
+
+        # Write to CSV file (only once the page is complete)
+        local_temp_file_path = f"{temp_dir_file_path}/local_metadata_i={str(i).zfill(5)}_page={window['page_count']}.csv"
+        with open(local_temp_file_path, 'w', newline='', encoding='UTF-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(HEADERS)
+            writer.writerows(rows)
+
+        # 3. Keep track of counters
+        window['nb_videos'] += int(search_results['pageInfo']['resultsPerPage'])
+        window['page_count'] += 1 
+
+        # 4. Go to next page if possible
+        if 'nextPageToken' not in search_results:
+            window['page_token'] = ''
+            window['finished'] = True
+            return
+        window['page_token'] = search_results['nextPageToken']
+
+
+def commit_window(window:dict,
+                  store,
+                  output_completion_log_path:str,
+                  temp_dir_file_path:str,
+                  seen_index:SeenVideoIndex = None) -> float:
+    """
+    Adds the csv files of a window to the metadata store
+    and writes the window to the {output_completion_log_path} csv file.
+
+    [Explanation]
+        Only the new rows are written, so the cost of a commit does not grow with the
+        size of the store. The store is written (and fsynced) before the completion log,
+        and the commit is only marked as complete once the completion log is written
+        (see CSVMetadataStore for how an interrupted commit is rolled back).
+
+        Returns the time spent on the commit in seconds.
+    """
+
+    i = window['i']
+    datetime_aft = window['datetime_aft']
+    datetime_bef = window['datetime_bef']
+    nb_videos = window['nb_videos']
+
+    start_time = time.perf_counter()
+
+    # Read the rows of the window (in the order of the pages)
+    new_csv_files = glob.glob(f"{temp_dir_file_path}/local_metadata_i={str(i).zfill(5)}_*.csv") 
+    new_csv_files.sort(key=lambda file: int(file.split('_page=')[-1][:-len('.csv')]))
+    rows = []
+    for file in new_csv_files:
+        with open(file, 'r', newline='', encoding='UTF-8') as f:
+            reader = csv.reader(f)
+            next(reader)  # Skip the header row
+            rows.extend(reader)
+
+    # Add to the store
+    store.append(i, rows)
+
+    # Completion print
+    print(f'√ {i} -- Number of Videos: {nb_videos} Completed at:{datetime.now().strftime("%y-%m-%d-%H-%M-%S")} -- Window[{datetime_aft.strftime("%y-%m-%d-%H-%M-%S")} ~> {datetime_bef.strftime("%y-%m-%d-%H-%M-%S")}]')
+    print_results = [i, datetime.now().strftime("%y-%m-%d-%H-%M-%S"),datetime_aft, datetime_bef, nb_videos, window['window_size_in_mins']]
+    with open(output_completion_log_path, 'a', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(print_results)
+        fsync(file)
+
+    store.mark_committed(i)
+
+    if seen_index is not None:
+        seen_index.record([row[1] for row in rows])
+
+    return time.perf_counter() - start_time
+
+
+def new_window(i:int, datetime_bef:datetime, window_size_in_mins:int) -> dict:
+    """
+    Returns the state of the window i covering [datetime_bef - window_size_in_mins, datetime_bef]
+    """
+    return {
+        'i': i,
+        'datetime_aft': datetime_bef - timedelta(minutes=window_size_in_mins),
+        'datetime_bef': datetime_bef,
+        'window_size_in_mins': window_size_in_mins,
+        'page_token': '',
+        'page_count': 0,
+        'nb_videos': 0,
+        'finished': False,
+    }
+
+
+def save_checkpoint(checkpoint_path:str, windows:list, i_end:int, adaptive_window:bool):
+    """
+    Saves the windows that are not committed yet, so that the next run resumes
+    from the exact window and page token
+    """
+
+    checkpoint = {
+        'i_end': i_end,
+        'adaptive_window': adaptive_window,
+        'windows': [dict(window,
+                         datetime_aft=window['datetime_aft'].isoformat(),
+                         datetime_bef=window['datetime_bef'].isoformat()) for window in windows],
+    }
+    temp_path = f'{checkpoint_path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(checkpoint, file, indent=4)
+    os.replace(temp_path, checkpoint_path)
+
+
+def load_checkpoint(checkpoint_path:str) -> dict:
+    with open(checkpoint_path, 'r', encoding='utf-8') as file:
+        checkpoint = json.load(file)
+    for window in checkpoint['windows']:
+        window['datetime_aft'] = datetime.fromisoformat(window['datetime_aft'])
+        window['datetime_bef'] = datetime.fromisoformat(window['datetime_bef'])
+    return checkpoint
+
+
+def next_window_size(window_size_in_mins:int,
+                     total_results:int,
+                     min_window_size_in_mins:int,
+                     max_window_size_in_mins:int,
+                     target_results:int = int(0.8 * MAX_RESULTS_PER_SEARCH)) -> int:
+    """
+    [Arguments]
+        window_size_in_mins: size of the current window in minutes
+        total_results: pageInfo.totalResults reported for the current window
+        min_window_size_in_mins / max_window_size_in_mins: bounds of the window size
+        target_results: number of results we aim for in a window
+                        (kept below the 500 results cap as totalResults is only an estimate)
+
+    [Returns]
+        window size (in whole minutes) expected to hold about target_results videos,
+        assuming the videos are uniformly spread within the window.
+        Growth is limited to a factor 2 per window to avoid jumping over a dense period.
+    """
+
+    scale = target_results / max(1, total_results)
+    window_size_in_mins = int(window_size_in_mins * min(2.0, scale))
+    return min(max_window_size_in_mins, max(min_window_size_in_mins, window_size_in_mins))
+
 
 def get_video_metadata(output_data_path:str,
                        output_completion_log_path:str,
@@ -19,10 +336,22 @@ def get_video_metadata(output_data_path:str,
                        i_start:int,
                        i_end:int,
                        ref_datetime:str,
-                       window_size_in_mins:int):
+                       window_size_in_mins:int,
+                       max_concurrent_windows:int = 1,
+                       adaptive_window:bool = False,
+                       min_window_size_in_mins:int = 1,
+                       max_window_size_in_mins:int = 43200,
+                       quota_budget:int = 10000,
+                       quota_ledger_path:str = 'data/quota_ledger.json',
+                       checkpoint_path:str = 'data/crawl_checkpoint.json',
+                       storage_backend:str = 'csv',
+                       seen_index_path:str = 'data/seen_video_ids.csv',
+                       refresh_ttl_days:float = None,
+                       query_config_path:str = QUERY_CONFIG_PATH,
+                       api_base_url:str = API_BASE_URL) -> dict:
     """
     [Arguments]
-        output_data_path: filepath to the CSV file to save data in
+        output_data_path: filepath to the CSV file (or SQLite database) to save data in
         output_completion_log_path: filepath to the CSV file to save completion results in
         temp_dir_file_path: filepath to save backup files
 
@@ -32,15 +361,36 @@ def get_video_metadata(output_data_path:str,
         ref_datetime: reference datetime to start the search from
                       (the latest date of the search window)
         window_size_in_mins: size of the search window in minutes
+        max_concurrent_windows: number of windows crawled at the same time
+
+        adaptive_window: adapt the size of every window to the density of the results
+        min_window_size_in_mins: smallest window size allowed with adaptive_window
+        max_window_size_in_mins: largest window size allowed with adaptive_window
 
+        quota_budget: number of credits that can be spent in a day
+        quota_ledger_path: filepath to the JSON file recording the credits spent today
+        checkpoint_path: filepath to the JSON file used to resume an interrupted crawl
+
+        storage_backend: 'csv' (single csv file) or 'sqlite' (database keyed by video_id, see metadata_store.py)
+        seen_index_path: filepath to the index of the videos already in the store (None: no deduplication)
+        refresh_ttl_days: the details (statistics) of known videos are requested again after refresh_ttl_days
+                          (None: never)
+        query_config_path: filepath to the YAML file of search parameters
+        api_base_url: base URL of the API (e.g. the URL of a MockYouTubeAPI for benchmarks)
+
+    [Returns]
+        statistics of the crawl:
+            - nb_windows: number of committed windows
+            - commit_times_secs: time spent on each commit
+            - counters: request counters per endpoint
 
     [Explanation]
         We want to extract all YouTube videos with 'wayang kulit' in the title using Google YouTube API.
         Each day, we are provided with 10 000 credits to make API calls.
             - Getting one page of results (up to 50 results) costs 100 credits each.
-            - Getting the details of a specific video costs 1 credit each.
-        This works out to at least 3 credits per video (≥2 for the search + 1 for the details) 
-        and about 6666 videos per day.
+            - Getting the details of up to 50 videos costs 1 credit per batched request.
+        This works out to slightly over 2 credits per video (2 for the search + 1/50 for the details)
+        and about 4950 videos per day.
 
         Note that for a given search, we can only access up to 10 pages (restriction imposed by Google).
         This gives a maximum of 500 videos per search.
@@ -54,7 +404,7 @@ def get_video_metadata(output_data_path:str,
             1. Get the list of YouTube videos with 'wayang kulit' in the title from 
                Google's YouTube API within the specified timeframe
 
-            2. For each video in the list:
+            2. For all the videos in the list (one batched request of up to 50 IDs):
                 a. Get the relevant information from the response
                     - Video URL
                     - Title
@@ -67,36 +417,72 @@ def get_video_metadata(output_data_path:str,
 
             3. If there's a next page, get results for the next page. 
                If not:
-                   - combine the csv file from {local_i={i}_metadata} csv file to the 
-                     main {output_data_path} csv file 
+                   - append the csv file from {local_i={i}_metadata} csv file to the 
+                     metadata store at {output_data_path}
                    - write to {output_completion_log_path} csv file
                    - redefine the timeframe to something earlier 
                    - go to step 2.
 
+        Historical backfills are bound by the latency of the API rather than by the CPU.
+        With max_concurrent_windows > 1, the range [ref_datetime - N windows, ref_datetime]
+        is split into its N windows up front and up to max_concurrent_windows of them are
+        crawled in parallel. Windows are still combined and logged in the order of i,
+        so the output files are identical to those of a sequential crawl.
+
+        With a fixed window size, dense periods overflow the 500 results cap (the extra videos
+        are silently lost) while sparse periods spend 100 credits on nearly empty windows.
+        With adaptive_window, the first page of a window is requested before paging it:
+            - if pageInfo.totalResults exceeds the cap, the window is shrunk and requested again
+            - after the window is crawled, the next window is resized according to its totalResults
+        The size of every window is written to the {output_completion_log_path} csv file.
+        Adaptive windows depend on each other, so they cannot be crawled concurrently.
+
+        Every request is charged to a quota ledger (100 credits per search page, 1 credit per
+        batched details request) that persists across runs and is reset at midnight Pacific time.
+        Before the budget is exceeded (or if the API reports that the quota is exceeded), the crawl
+        stops cleanly: the windows that are not committed yet are saved to {checkpoint_path},
+        including their next page token. The next run resumes from the checkpoint, in which case
+        i_start, i_end, ref_datetime and window_size_in_mins are taken from the checkpoint.
+
     """
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~#
     #   Filepath management   #
     #~~~~~~~~~~~~~~~~~~~~~~~~~#
 
-    # Check if output file exists
-    headers = ['i', 'video_id', 'URL', 'channel_name', 'title', 'published_date', 'duration', 'view_count', 'like_count', 'comment_count', 'description']
-    if os.path.exists(output_data_path) == False:
-        with open(output_data_path, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(headers)
+    # Open (or create) the metadata store
+    store = get_metadata_store(storage_backend, output_data_path)
 
     # Check if output completion_results file exists
     if os.path.exists(output_completion_log_path) == False:
         with open(output_completion_log_path, mode='w', newline='') as file:
             writer = csv.writer(file)
-            writer.writerow(['i', 'completed_datetime','window_start_datetime', 'window_end_datetime', 'nb_videos'])
+            writer.writerow(COMPLETION_LOG_HEADERS)
+    else:
+        # Older completion logs do not have the window_size_in_mins column, and a log left empty by a crash has no header
+        with open(output_completion_log_path, mode='r', encoding='UTF-8') as file:
+            log_rows = list(csv.reader(file))
+        if not log_rows or log_rows[0] != COMPLETION_LOG_HEADERS:
+            with open(output_completion_log_path, mode='w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(COMPLETION_LOG_HEADERS)
+                writer.writerows([row + [''] * (len(COMPLETION_LOG_HEADERS) - len(row)) for row in log_rows[1:]])
+
+    # Resume from the checkpoint of an interrupted crawl
+    checkpoint = None
+    if os.path.exists(checkpoint_path):
+        checkpoint = load_checkpoint(checkpoint_path)
+        i_start = checkpoint['windows'][0]['i']
+        i_end = checkpoint['i_end']
+        adaptive_window = checkpoint['adaptive_window']
+        print(f'Resuming from {checkpoint_path}: windows {i_start} to {i_end - 1}')
 
     # Check if temp dir file path exists
     if os.path.exists(temp_dir_file_path) == False:
         os.makedirs(temp_dir_file_path)
-    else:
+    elif checkpoint is None:
         # Ensure that the backup file is empty
+        # (when resuming, the backup files of the checkpointed windows are needed)
         for i in range(i_start,i_end):
             for page_nb in range(10):
                 for file in os.listdir(temp_dir_file_path):
@@ -111,6 +497,15 @@ def get_video_metadata(output_data_path:str,
     if i_start >= i_end:
         raise ValueError('i_start has to be < i_end')
 
+    if max_concurrent_windows < 1:
+        raise ValueError('max_concurrent_windows has to be >= 1')
+
+    if adaptive_window and max_concurrent_windows > 1:
+        raise ValueError('adaptive_window cannot be combined with max_concurrent_windows > 1')
+
+    if adaptive_window and not (0 < min_window_size_in_mins <= max_window_size_in_mins):
+        raise ValueError('0 < min_window_size_in_mins <= max_window_size_in_mins is required')
+
     # Each API request is enumerated with i. 
     # We need to ensure that there are no duplicates of identifier i
     last_value_of_i = -1
@@ -124,13 +519,33 @@ def get_video_metadata(output_data_path:str,
     if i_start <= last_value_of_i:
         raise ValueError('i_start must be greater than the last value of i in the completion log file')
 
-    # We have i_start and i_end to keep track of the number of pages called:
-    i = i_start
+    # Undo a commit that was interrupted by the previous run
+    store.recover(last_value_of_i)
+
+    # Videos already in the store are not fetched again
+    seen_index = None
+    if seen_index_path is not None:
+        is_new_index = not os.path.exists(seen_index_path)
+        refresh_ttl = timedelta(days=refresh_ttl_days) if refresh_ttl_days is not None else None
+        seen_index = SeenVideoIndex(seen_index_path, refresh_ttl=refresh_ttl)
+        if is_new_index:
+            seen_index.seed(store)
+        print(f'Video index: {len(seen_index)} known videos')
 
     # Define the initial starting point (latest date) and the interval of the window in minutes
     # Take note that the query started from present moment and we are going backwards in time
-    datetime_bef = datetime.fromisoformat(ref_datetime)
-    window_end_datetime = datetime_bef.isoformat() + 'Z'
+    # Window i covers [datetime_aft, datetime_bef], and window i+1 is the one just before it
+    if checkpoint is not None:
+        windows = checkpoint['windows']
+    elif adaptive_window:
+        window_size_in_mins = min(max_window_size_in_mins, max(min_window_size_in_mins, window_size_in_mins))
+        windows = [new_window(i_start, datetime.fromisoformat(ref_datetime), window_size_in_mins)]
+    else:
+        window_size_in_mins = max(1, window_size_in_mins)
+        windows = []
+        for k, i in enumerate(range(i_start, i_end)):
+            datetime_bef = datetime.fromisoformat(ref_datetime) - timedelta(minutes=k * window_size_in_mins)
+            windows.append(new_window(i, datetime_bef, window_size_in_mins))
 
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~#
@@ -141,150 +556,101 @@ def get_video_metadata(output_data_path:str,
     load_dotenv()
     API_KEY = os.getenv('YOUTUBE_DATA_API_KEY')
 
-    # Counters and page tracking
-    nb_videos_on_page = 0
-    pageToken = ''
-    page_count = 0
+    # Credits spent today (shared with the previous runs)
+    ledger = QuotaLedger(quota_ledger_path, budget=quota_budget)
+    print(f'Quota: {ledger.remaining()}/{quota_budget} credits remaining today')
+
+    # Search parameters, parsed once for the whole crawl
+    search_template = compile_search_template(query_config_path)
+
+    # A single client (and connection pool) is shared by the whole crawl
+    client = YouTubeClient(API_KEY, pool_maxsize=max(10, max_concurrent_windows), ledger=ledger, base_url=api_base_url)
 
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~#
     #      Grab Metadata      #
     #~~~~~~~~~~~~~~~~~~~~~~~~~#
 
-    while i < i_end:
-
-        # 1. Obtain the list of YouTube videos with 'wayang kulit'
-        # Date interval definition 
-        datetime_aft = datetime_bef - timedelta(minutes=max(1,window_size_in_mins))
-        window_start_datetime = datetime_aft.isoformat() + 'Z'
-
-        # Load the configuration as a dictionary
-        with open("src/query_config.yaml", "r") as f:
-            yaml_dict = yaml.safe_load(f)
-        yaml_dict["pageToken"] = pageToken 
-        yaml_dict["publishedAfter"] = window_start_datetime
-        yaml_dict["publishedBefore"] = window_end_datetime
-
-        # Calling search results
-        youtube = build('youtube', 'v3', developerKey=API_KEY)
-        search_request = youtube.search().list(**yaml_dict)
-
-        # search_request = youtube.search().list(
-        #     part='snippet',
-        #     channelType='any',
-        #     eventType='completed',
-        #     maxResults=50,
-        #     order='relevance',
-        #     pageToken=pageToken,
-        #     publishedAfter=window_start_datetime,
-        #     publishedBefore=window_end_datetime,
-        #     q='wayang kulit',
-        #     # relevanceLanguage='id',
-        #     type='video',
-        #     videoCaption='any',
-        #     videoDefinition='any',
-        #     videoDimension='any',
-        #     videoDuration='any',
-        #     videoEmbeddable='any',
-        #     videoLicense	='any',
-        #     videoPaidProductPlacement='any',
-        #     videoSyndicated='any',
-        #     videoType='any',
-        # )
-
-        search_results = search_request.execute()
-
-        # Create CSV file to write search results to
-        local_temp_file_path = f"{temp_dir_file_path}/local_metadata_i={str(i).zfill(5)}_page={page_count}.csv"
-        with open(local_temp_file_path, 'a', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(headers)
-
-        # 2. For each video in the search results,
-        for video_details in search_results['items']:
-
-            # 2a. Grab the video description, etc...
-            video_id = video_details['id']['videoId']
-            url = "https://www.googleapis.com/youtube/v3/videos"
-            params = {
-                'id'  : video_id,
-                'part': 'contentDetails, snippet, statistics',
-                'key' : API_KEY}
-            response = requests.get(url, params=params)
-
-            # Ensure that response is valid, if not throw error
-            if response.status_code != 200:
-                print('nope!')
-                raise HttpError(response.status_code)
-
-            # 2b. Parse the results and insert into csv
-            results = json.loads(response.text)
-
-            id = results['items'][0]['id']
-            channel_name = results['items'][0]['snippet']['channelTitle']
-            title = results['items'][0]['snippet']['title']
-            try: 
-                view_count = results['items'][0]['statistics']['viewCount']
-            except:
-                view_count = None
-
-            try: 
-                like_count = results['items'][0]['statistics']['likeCount']
-            except:
-                like_count = None
-
+    commit_times = []
+    try:
+        if adaptive_window:
+            window = windows[0]
+            while True:
+
+                # Shrink the window until its results fit within the cap (only before paging it)
+                first_search_results = None
+                total_results = None
+                while window['page_count'] == 0:
+                    first_search_results = search_page(client, search_template, window['datetime_aft'], window['datetime_bef'])
+                    total_results = int(first_search_results['pageInfo']['totalResults'])
+                    if total_results <= MAX_RESULTS_PER_SEARCH or window['window_size_in_mins'] <= min_window_size_in_mins:
+                        break
+                    window_size_in_mins = next_window_size(window['window_size_in_mins'], total_results, min_window_size_in_mins, max_window_size_in_mins)
+                    print(f"~ {window['i']} -- {total_results} results, shrinking window to {window_size_in_mins} mins")
+                    window = new_window(window['i'], window['datetime_bef'], window_size_in_mins)
+                    windows = [window]
+
+                if not window['finished']:
+                    crawl_window(client, search_template, window, temp_dir_file_path, first_search_results, seen_index)
+                commit_times.append(commit_window(window, store, output_completion_log_path, temp_dir_file_path, seen_index))
+
+                if window['i'] + 1 >= i_end:
+                    windows = []
+                    break
+
+                # Resize the next window according to the density of this one
+                # (a resumed window did not keep its totalResults, so its size is kept)
+                if total_results is not None:
+                    window_size_in_mins = next_window_size(window['window_size_in_mins'], total_results, min_window_size_in_mins, max_window_size_in_mins)
+                else:
+                    window_size_in_mins = window['window_size_in_mins']
+                window = new_window(window['i'] + 1, window['datetime_aft'], window_size_in_mins)
+                windows = [window]
+
+        else:
+            # Crawl windows in parallel, but only commit window i once windows < i are committed
+            executor = ThreadPoolExecutor(max_workers=max_concurrent_windows)
             try:
-                comment_count = results['items'][0]['statistics']['commentCount']
-            except:
-                comment_count = None
-
-            duration = isodate.parse_duration(results['items'][0]['contentDetails']['duration']).total_seconds()
-            published_date = results['items'][0]['snippet']['publishedAt']
-            description = results['items'][0]['snippet']['description']
-
-            # Write to CSV file
-            local_temp_file_path = f"{temp_dir_file_path}/local_metadata_i={str(i).zfill(5)}_page={page_count}.csv"
-
-            results = [i, id, f'https://www.youtube.com/watch?v={id}', channel_name, title, published_date, duration, view_count, like_count, comment_count, description]
-            with open(local_temp_file_path, 'a', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(results)
+                futures = [executor.submit(crawl_window, client, search_template, window, temp_dir_file_path, None, seen_index)
+                           for window in windows if not window['finished']]
+                quota_error = None
+                completed_futures = as_completed(futures)
+                while True:
+                    while len(windows) > 0 and windows[0]['finished']:
+                        commit_times.append(commit_window(windows.pop(0), store, output_completion_log_path, temp_dir_file_path, seen_index))
+
+                    future = next(completed_futures, None)
+                    if future is None:
+                        break
+                    try:
+                        future.result()
+                    except QuotaBudgetExhausted as error:
+                        quota_error = error
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+            if quota_error is not None:
+                raise quota_error
+
+    except QuotaBudgetExhausted as error:
+        save_checkpoint(checkpoint_path, windows, i_end, adaptive_window)
+        print(f'Quota budget exhausted ({error}). Progress saved to {checkpoint_path}, run again once the quota is reset.')
 
+    else:
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
 
-        # 3. Keep track of counters
-        nb_videos_on_page += int(search_results['pageInfo']['resultsPerPage'])
-        page_count += 1 
+    # Request statistics of the crawl
+    print(client.summary())
+    client.close()
+    store.close()
 
+    return {
+        'nb_windows': len(commit_times),
+        'commit_times_secs': commit_times,
+        'counters': client.counters,
+    }
 
-        # 4. Go to next page if possible. If not, write to log and redefine the search window
-        try:
-            pageToken = search_results['nextPageToken']
-
-        except:
-            
-            # Combine to main file
-            new_csv_files = glob.glob(f"{temp_dir_file_path}/local_metadata_i={str(i).zfill(5)}_*.csv") 
-            old_df = [pd.read_csv(output_data_path)]
-            new_dfs = [pd.read_csv(file) for file in new_csv_files if pd.read_csv(file).empty == False]
-            df = pd.concat(old_df + new_dfs, ignore_index=True)
-            df.to_csv(output_data_path,index=False)
-
-            # Completion print
-            print(f'√ {i} -- Number of Videos: {nb_videos_on_page} Completed at:{datetime.now().strftime("%y-%m-%d-%H-%M-%S")} -- Window[{datetime_aft.strftime("%y-%m-%d-%H-%M-%S")} ~> {datetime_bef.strftime("%y-%m-%d-%H-%M-%S")}]')
-            print_results = [i, datetime.now().strftime("%y-%m-%d-%H-%M-%S"),datetime_aft, datetime_bef, nb_videos_on_page]
-            with open(output_completion_log_path, 'a', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(print_results)
-
-            # Re-adjust parameters
-            pageToken = ''
-            datetime_bef = datetime_aft
-            window_end_datetime = datetime_bef.isoformat() + 'Z'
-            window_size_in_mins = window_size_in_mins
-            i += 1
-            page_count = 0
-            nb_videos_on_page = 0
-            
 
 if __name__ == "__main__":
 
@@ -341,8 +707,23 @@ if __name__ == "__main__":
     parser.add_argument('--i_end', default=i_end, type=int, help='API Results tracking end (exclusive)')
     parser.add_argument('--ref_datetime', type=str, default=ref_datetime, help='Reference datetime to start the search from')
     parser.add_argument('--window_size_in_mins', type=int, default=window_size_in_mins, help='Size of the search window in minutes')
+    parser.add_argument('--max_concurrent_windows', type=int, default=1, help='Number of windows crawled at the same time')
+    parser.add_argument('--adaptive_window', action='store_true', help='Adapt the window size to the density of the results')
+    parser.add_argument('--min_window_size_in_mins', type=int, default=1, help='Smallest window size allowed with --adaptive_window')
+    parser.add_argument('--max_window_size_in_mins', type=int, default=43200, help='Largest window size allowed with --adaptive_window')
+    parser.add_argument('--quota_budget', type=int, default=10000, help='Number of credits that can be spent in a day')
+    parser.add_argument('--quota_ledger_path', type=str, default='data/quota_ledger.json', help='Filepath to the JSON file recording the credits spent today')
+    parser.add_argument('--storage_backend', type=str, default='csv', choices=['csv', 'sqlite'], help='Storage backend of the metadata (csv file or SQLite database keyed by video_id)')
+    parser.add_argument('--seen_index_path', type=str, default='data/seen_video_ids.csv', help='Filepath to the index of the videos already in the store')
+    parser.add_argument('--refresh_ttl_days', type=float, default=None, help='Request the details of known videos again after this number of days')
+    parser.add_argument('--query_config_path', type=str, default=QUERY_CONFIG_PATH, help='Filepath to the YAML file of search parameters')
+    parser.add_argument('--checkpoint_path', type=str, default='data/crawl_checkpoint.json', help='Filepath to the JSON file used to resume an interrupted crawl')
     args = parser.parse_args()
 
+    # The SQLite store lives next to the default csv file
+    if args.storage_backend == 'sqlite' and args.output_data_path == output_data_path:
+        args.output_data_path = 'data/video_metadata.db'
+
 
     # Get video metadata
     get_video_metadata(
@@ -352,7 +733,18 @@ if __name__ == "__main__":
         i_start=args.i_start,
         i_end=args.i_end,
         ref_datetime=args.ref_datetime,
-        window_size_in_mins=args.window_size_in_mins
+        window_size_in_mins=args.window_size_in_mins,
+        max_concurrent_windows=args.max_concurrent_windows,
+        adaptive_window=args.adaptive_window,
+        min_window_size_in_mins=args.min_window_size_in_mins,
+        max_window_size_in_mins=args.max_window_size_in_mins,
+        quota_budget=args.quota_budget,
+        quota_ledger_path=args.quota_ledger_path,
+        checkpoint_path=args.checkpoint_path,
+        storage_backend=args.storage_backend,
+        seen_index_path=args.seen_index_path,
+        refresh_ttl_days=args.refresh_ttl_days,
+        query_config_path=args.query_config_path
     )
 
 
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import threading
+
+try:
+    from zoneinfo import ZoneInfo
+    QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+except Exception:
+    QUOTA_TIMEZONE = timezone(timedelta(hours=-8))
+
+
+# Cost in credits of one request to each endpoint
+# (failed requests are charged as well by the API)
+QUOTA_COSTS = {
+    'search': 100,
+    'videos': 1,
+}
+
+
+class QuotaBudgetExhausted(Exception):
+    """
+    Raised when a request would exceed the daily budget of credits
+    """
+
+
+class QuotaLedger():
+    """
+    Persistent record of the credits spent on the YouTube Data API.
+
+    The quota of an API key is reset at midnight Pacific time, so the ledger
+    keeps the number of credits spent on the current (Pacific) day in a small
+    JSON file that is shared by consecutive runs of the crawler.
+
+    [Arguments]
+        ledger_path: filepath to the JSON file of the ledger
+        budget: number of credits that can be spent in a day
+    """
+
+    def __init__(self, ledger_path:str, budget:int = 10000):
+
+        self.ledger_path = ledger_path
+        self.budget = budget
+        self._lock = threading.Lock()
+
+        self.date = self._today()
+        self.spent = 0
+        if os.path.exists(ledger_path):
+            with open(ledger_path, 'r', encoding='utf-8') as file:
+                ledger = json.load(file)
+            if ledger['date'] == self.date:
+                self.spent = ledger['spent']
+
+    def charge(self, endpoint:str):
+        """
+        Records the cost of one request to the endpoint.
+        Raises QuotaBudgetExhausted (without charging anything) if the budget would be exceeded.
+        """
+
+        cost = QUOTA_COSTS[endpoint]
+        with self._lock:
+            self._reset_if_new_day()
+            if self.spent + cost > self.budget:
+                raise QuotaBudgetExhausted(f'{self.spent}/{self.budget} credits spent on {self.date}, '
+                                           f'cannot afford a {endpoint} request ({cost} credits)')
+            self.spent += cost
+            self._save()
+
+    def mark_exhausted(self):
+        """
+        Called when the API itself reports that the quota is exceeded
+        """
+        with self._lock:
+            self._reset_if_new_day()
+            self.spent = max(self.spent, self.budget)
+            self._save()
+
+    def remaining(self) -> int:
+        with self._lock:
+            self._reset_if_new_day()
+            return self.budget - self.spent
+
+    def _reset_if_new_day(self):
+        today = self._today()
+        if today != self.date:
+            self.date = today
+            self.spent = 0
+
+    def _today(self) -> str:
+        return datetime.now(QUOTA_TIMEZONE).strftime('%Y-%m-%d')
+
+    def _save(self):
+        # Write to a temporary file first so that the ledger is never left half-written
+        dirname = os.path.dirname(self.ledger_path)
+        if dirname != '':
+            os.makedirs(dirname, exist_ok=True)
+        temp_path = f'{self.ledger_path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'date': self.date, 'spent': self.spent}, file)
+        os.replace(temp_path, self.ledger_path)
@@ -0,0 +1,156 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .quota import QuotaBudgetExhausted, QuotaLedger
+
+
+API_BASE_URL = "https://www.googleapis.com/youtube/v3"
+
+# Status codes worth retrying (403 is only retried for rate limiting, see below)
+RETRY_STATUS_CODES = {403, 429, 500, 502, 503, 504}
+
+# 403 reasons that will not go away by waiting a few seconds
+QUOTA_403_REASONS = {'quotaExceeded', 'dailyLimitExceeded'}
+NON_RETRYABLE_403_REASONS = QUOTA_403_REASONS | {'forbidden', 'keyInvalid', 'accessNotConfigured'}
+
+
+class YouTubeClient():
+    """
+    Thin client over the YouTube Data API v3 REST endpoints.
+
+    One client is meant to be created per crawl: the underlying requests.Session
+    keeps TCP/TLS connections alive between calls, so every page only pays for
+    the request itself instead of a fresh handshake and discovery-document parse.
+
+    [Arguments]
+        api_key: YouTube Data API key
+        max_retries: number of retries on 403 (rate limits) / 429 / 5xx / connection errors
+        backoff_base: initial waiting time in seconds, doubled after every retry
+        backoff_max: maximum waiting time in seconds between two retries
+        timeout: timeout in seconds of a single HTTP request
+        pool_maxsize: maximum number of pooled connections kept alive
+        ledger: QuotaLedger charged before every request (optional)
+        base_url: base URL of the API (e.g. the URL of a MockYouTubeAPI)
+    """
+
+    def __init__(self,
+                 api_key:str,
+                 max_retries:int = 5,
+                 backoff_base:float = 1.0,
+                 backoff_max:float = 64.0,
+                 timeout:float = 30.0,
+                 pool_maxsize:int = 10,
+                 ledger:QuotaLedger = None,
+                 base_url:str = API_BASE_URL):
+
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.ledger = ledger
+
+        # Keep-alive connection pool
+        self.session = requests.Session()
+        self.session.params = {'key': api_key}
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # Counters (shared between threads)
+        self._lock = threading.Lock()
+        self.counters = {}
+
+    def search(self, params:dict) -> dict:
+        return self._get('search', params)
+
+    def videos(self, params:dict) -> dict:
+        return self._get('videos', params)
+
+    def close(self):
+        self.session.close()
+
+    def _get(self, endpoint:str, params:dict) -> dict:
+        """
+        GET request with exponential backoff.
+        Raises requests.HTTPError once the retries are exhausted or if the error is not retryable,
+        and QuotaBudgetExhausted if the ledger's budget or the API quota is exhausted.
+        """
+
+        url = f'{self.base_url}/{endpoint}'
+
+        for attempt in range(self.max_retries + 1):
+
+            if self.ledger is not None:
+                self.ledger.charge(endpoint)
+
+            start_time = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                self._count(endpoint, time.perf_counter() - start_time, 0, error=True)
+                if attempt == self.max_retries:
+                    raise
+                self._sleep(attempt)
+                continue
+
+            self._count(endpoint, time.perf_counter() - start_time, len(response.content), error=response.status_code != 200)
+
+            if response.status_code == 200:
+                return response.json()
+
+            if response.status_code == 403 and get_error_reason(response) in QUOTA_403_REASONS:
+                if self.ledger is not None:
+                    self.ledger.mark_exhausted()
+                raise QuotaBudgetExhausted(f'The API reported that the quota is exceeded ({endpoint})')
+
+            if not self._is_retryable(response) or attempt == self.max_retries:
+                response.raise_for_status()
+
+            self._sleep(attempt, response.headers.get('Retry-After'))
+
+    def _is_retryable(self, response) -> bool:
+        if response.status_code not in RETRY_STATUS_CODES:
+            return False
+        if response.status_code == 403:
+            return get_error_reason(response) not in NON_RETRYABLE_403_REASONS
+        return True
+
+    def _sleep(self, attempt:int, retry_after:str = None):
+        if retry_after is not None and retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = self.backoff_base * (2 ** attempt) * (1 + random.random())
+        time.sleep(min(delay, self.backoff_max))
+
+    def _count(self, endpoint:str, latency:float, nb_bytes:int, error:bool):
+        with self._lock:
+            counter = self.counters.setdefault(endpoint, {'requests': 0, 'errors': 0, 'latency_secs': 0.0, 'bytes': 0})
+            counter['requests'] += 1
+            counter['errors'] += int(error)
+            counter['latency_secs'] += latency
+            counter['bytes'] += nb_bytes
+
+    def summary(self) -> str:
+        with self._lock:
+            string = ''
+            for endpoint, counter in self.counters.items():
+                mean_latency = counter['latency_secs'] / max(1, counter['requests'])
+                string += f"{endpoint}: {counter['requests']} requests ({counter['errors']} errors), " \
+                          f"{mean_latency * 1000:.0f} ms/request, {counter['bytes'] / 1e6:.2f} MB -- "
+            return string[:-4]
+
+
+def get_error_reason(response) -> str:
+    """
+    Returns the 'reason' field of a YouTube Data API error response (e.g. quotaExceeded)
+    """
+    try:
+        return response.json()['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return ''
@@ -0,0 +1,118 @@
+import os
+import resource
+import subprocess
+import tempfile
+import time
+
+import argparse
+
+from thumbnails_extractor import extract_frames_every_n_seconds
+
+
+def generate_test_video(video_path: str, resolution: tuple, duration_secs: float, fps: float = 25):
+    """
+    Encode a synthetic H.264 video (moving test pattern, 5 s between keyframes, like YouTube)
+    """
+
+    subprocess.run(
+        [
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-y",
+            "-f", "lavfi", "-i", f"testsrc2=size={resolution[0]}x{resolution[1]}:rate={fps}",
+            "-t", str(duration_secs),
+            "-c:v", "libx264", "-preset", "veryfast", "-g", str(int(5 * fps)), "-pix_fmt", "yuv420p",
+            video_path,
+        ],
+        check=True,
+    )
+
+
+def benchmark_extraction(
+    video_path: str,
+    backend: str,
+    sampling_fps: float = 1,
+    thumbnails_resolution: tuple = (320, 240),
+    ffmpeg_threads: int = 0,
+    ffmpeg_fast_decode: bool = False,
+) -> dict:
+    """
+    [Returns]
+        dictionary of metrics:
+            - wall_time_secs: time to extract the frames
+            - cpu_time_secs: CPU time of this process and of its children (ffmpeg)
+            - frames_per_sec: extracted frames per second of wall time
+    """
+
+    with tempfile.TemporaryDirectory() as thumbnails_output_dir:
+
+        start_usage = [resource.getrusage(who) for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]]
+        start_time = time.perf_counter()
+        nb_frames = extract_frames_every_n_seconds(
+            video_path=video_path,
+            thumbnails_output_dir=thumbnails_output_dir,
+            sampling_fps=sampling_fps,
+            thumbnails_resolution=thumbnails_resolution,
+            backend=backend,
+            ffmpeg_threads=ffmpeg_threads,
+            ffmpeg_fast_decode=ffmpeg_fast_decode,
+        )
+        wall_time = time.perf_counter() - start_time
+        end_usage = [resource.getrusage(who) for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]]
+
+    cpu_time = sum(
+        (end.ru_utime + end.ru_stime) - (start.ru_utime + start.ru_stime)
+        for start, end in zip(start_usage, end_usage)
+    )
+
+    return {
+        "nb_frames": nb_frames,
+        "wall_time_secs": wall_time,
+        "cpu_time_secs": cpu_time,
+        "frames_per_sec": nb_frames / wall_time,
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Compare the OpenCV and ffmpeg extraction backends on synthetic 720p and 1080p videos."
+    )
+    parser.add_argument(
+        "--duration_secs",
+        type=float,
+        default=120,
+        help="Duration of the test videos",
+    )
+    parser.add_argument(
+        "--sampling_fps",
+        type=float,
+        default=1,
+        help="Sampling rate in frames per second",
+    )
+    parser.add_argument(
+        "--ffmpeg_threads",
+        type=int,
+        default=0,
+        help="Number of decoding threads of ffmpeg (0: chosen by ffmpeg)",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as videos_dir:
+        for name, resolution in [("720p", (1280, 720)), ("1080p", (1920, 1080))]:
+
+            video_path = f"{videos_dir}/{name}.mp4"
+            generate_test_video(video_path, resolution, args.duration_secs)
+            print(f"\n[{name}] {args.duration_secs:g} s, {os.path.getsize(video_path) / 1e6:.1f} MB, sampled at {args.sampling_fps:g} fps")
+
+            for backend, ffmpeg_fast_decode in [("opencv", False), ("ffmpeg", False), ("ffmpeg", True)]:
+                metrics = benchmark_extraction(
+                    video_path,
+                    backend,
+                    sampling_fps=args.sampling_fps,
+                    ffmpeg_threads=args.ffmpeg_threads,
+                    ffmpeg_fast_decode=ffmpeg_fast_decode,
+                )
+                label = f"{backend} (fast decode)" if ffmpeg_fast_decode else backend
+                print(
+                    f"{label:>20} -- {metrics['nb_frames']} frames in {metrics['wall_time_secs']:.2f} s "
+                    f"({metrics['frames_per_sec']:.1f} frames/s), CPU {metrics['cpu_time_secs']:.2f} s"
+                )
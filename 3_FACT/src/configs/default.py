@@ -29,6 +29,11 @@ cfg.dataset = ""
 cfg.sr = 1  # temporal down-sample rate
 cfg.eval_bg = True  # if including background frame in evaluation
 cfg.nclasses = 2
+cfg.feature_type = "thumbnails"  # thumbnails: raw pixels of the frames extracted by thumbnails_extractor.py; npy: one feature file per video (e.g. feature_encoder.py)
+cfg.reduction_path = None  # PCA / random projection applied to raw pixels while loading (dimensionality_reduction.py)
+cfg.feature_cache_dir = "data/feature_cache"  # memory-mapped copies of the decoded thumbnails (relative to the project base, None: no cache)
+cfg.video_cache_gb = 4.0  # budget of the in-RAM cache of loaded videos shared by the train and test datasets (0.0: no cache, a float for yacs)
+cfg.label_store_dir = "data/label_store"  # groundtruth compiled to int16 arrays and a vocabulary (relative to the project base, None: parse the text files)
 
 # training
 cfg.batch_size = 4
@@ -39,6 +44,9 @@ cfg.lr_decay = -1
 cfg.momentum = 0.009
 cfg.weight_decay = 0.000
 cfg.clip_grad_norm = 10.0
+cfg.num_workers = 2  # threads loading the next batches during the forward/backward passes (0: load in the training loop)
+cfg.prefetch_batches = 2  # number of batches loaded ahead
+cfg.pin_memory = True  # page-locked batches for asynchronous copies to the GPU (ignored without CUDA)
 
 #########################
 # model
@@ -0,0 +1,234 @@
+import os
+import shutil
+
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+try:
+    from thumbnails_extractor import FRAME_INDEX_FILE_NAME, count_frames, iterate_frame_batches
+except ImportError:
+    # Imported from the src package (by utils/dataset.py for cfg.reduction_path)
+    from .thumbnails_extractor import FRAME_INDEX_FILE_NAME, count_frames, iterate_frame_batches
+
+METHODS = ["pca", "random_projection"]
+
+
+class Reduction:
+    """
+    Projection of flattened frames (raw pixels, as returned by dataset.load_thumbnails)
+    to n_components dimensions, fitted once by fit_reduction and saved as a .npz file.
+
+        - pca: (frames - mean) @ components.T
+        - random_projection: frames @ components.T, with a sparse components matrix
+    """
+
+    def __init__(self, method: str, components, mean: np.ndarray = None):
+        self.method = method
+        self.components = components
+        self.mean = mean
+
+    @property
+    def n_components(self) -> int:
+        return self.components.shape[0]
+
+    def transform(self, frames: np.ndarray, chunk_size: int = 256) -> np.ndarray:
+        """
+        Project (nb_frames x dimension) frames, chunk by chunk to bound the float32 copies
+        """
+
+        output = np.empty((frames.shape[0], self.n_components), dtype=np.float32)
+        for start in range(0, frames.shape[0], chunk_size):
+            chunk = np.asarray(frames[start:start + chunk_size], dtype=np.float32)
+            if self.mean is not None:
+                chunk = chunk - self.mean
+            output[start:start + chunk_size] = self.components.dot(chunk.T).T
+        return output
+
+    def save(self, reduction_path: str):
+        if self.method == "pca":
+            np.savez(reduction_path, method=self.method, components=self.components, mean=self.mean)
+        else:
+            components = self.components.tocsr()
+            np.savez(
+                reduction_path,
+                method=self.method,
+                data=components.data,
+                indices=components.indices,
+                indptr=components.indptr,
+                shape=np.array(components.shape),
+            )
+
+
+def load_reduction(reduction_path: str) -> Reduction:
+    with np.load(reduction_path) as file:
+        method = str(file["method"])
+        if method == "pca":
+            return Reduction(method, file["components"], file["mean"])
+
+        from scipy import sparse
+        components = sparse.csr_matrix((file["data"], file["indices"], file["indptr"]), shape=tuple(file["shape"]))
+        return Reduction(method, components)
+
+
+def fit_reduction(
+    thumbnails_parent_dir: str,
+    video_list: list,
+    reduction_path: str,
+    method: str = "pca",
+    n_components: int = 256,
+    batch_size: int = 512,
+    seed: int = 2025,
+) -> Reduction:
+    """
+    Fit a dimensionality reduction of the raw pixels on the training videos.
+
+    [Arguments]
+            thumbnails_parent_dir - directory of the thumbnails directories of every video
+            video_list - videos to fit the reduction on (e.g. train_video_list)
+            reduction_path - path to the .npz file to save the reduction in
+            method - "pca" (incremental PCA) or "random_projection" (sparse random projection)
+            n_components - dimension after the reduction
+            batch_size - number of frames per partial fit of the PCA (at least n_components)
+            seed - seed of the random projection
+
+    [Returns]
+            Reduction
+
+    [Explanation]
+            For deployments without a CNN encoder (see feature_encoder.py), the flattened
+            pixels (230,400 values per 320x240 frame) are projected to a few hundred
+            dimensions. The PCA is fitted out-of-core: frames are streamed video by video
+            and passed to IncrementalPCA.partial_fit by batches of batch_size frames, so
+            the memory used is about (batch_size + n_components) frames, never the corpus.
+            The sparse random projection needs no pass over the data at all.
+    """
+
+    from sklearn.decomposition import IncrementalPCA
+    from sklearn.random_projection import SparseRandomProjection
+
+    if method not in METHODS:
+        raise ValueError(f"method has to be one of {METHODS}")
+
+    if method == "random_projection":
+        frame = next(iterate_frame_batches(f"{thumbnails_parent_dir}/{video_list[0]}", 1))
+        projection = SparseRandomProjection(n_components=n_components, random_state=seed)
+        projection.fit(np.zeros((1, frame[0].size), dtype=np.float32))
+        reduction = Reduction(method, projection.components_.astype(np.float32))
+
+    else:
+        batch_size = max(batch_size, n_components)
+        pca = IncrementalPCA(n_components=n_components)
+        buffer, buffer_size = [], 0
+        for video_id in tqdm(video_list):
+            for frames in iterate_frame_batches(f"{thumbnails_parent_dir}/{video_id}", batch_size):
+                buffer.append(frames.reshape(frames.shape[0], -1).astype(np.float32))
+                buffer_size += frames.shape[0]
+                if buffer_size >= batch_size:
+                    pca.partial_fit(np.concatenate(buffer))
+                    buffer, buffer_size = [], 0
+
+        # The last partial fit needs at least n_components frames
+        if buffer_size >= n_components or (buffer_size > 0 and not hasattr(pca, "components_")):
+            pca.partial_fit(np.concatenate(buffer))
+        reduction = Reduction(method, pca.components_.astype(np.float32), pca.mean_.astype(np.float32))
+
+    reduction.save(reduction_path)
+    return reduction
+
+
+def reduce_thumbnails_dir(
+    thumbnails_parent_dir: str,
+    reduction_path: str,
+    features_output_dir: str,
+    batch_size: int = 256,
+):
+    """
+    Apply a fitted reduction to the thumbnails of every video.
+
+    [Arguments]
+            thumbnails_parent_dir - directory of the thumbnails directories of every video
+            reduction_path - .npz file written by fit_reduction
+            features_output_dir - directory to save the features in ({video_id}.npy, float32: the
+                                  projections of 0-255 pixels overflow float16)
+            batch_size - number of frames projected at once
+
+    [Returns]
+            nothing. Use the output directory as thumbnails_dir with feature_type: npy
+            in the configuration (or set reduction_path to reduce while loading instead)
+    """
+
+    reduction = load_reduction(reduction_path)
+    os.makedirs(features_output_dir, exist_ok=True)
+
+    video_ids = sorted(
+        video_id
+        for video_id in os.listdir(thumbnails_parent_dir)
+        if os.path.isdir(f"{thumbnails_parent_dir}/{video_id}")
+    )
+
+    for video_id in tqdm(video_ids):
+
+        thumbnails_dir = f"{thumbnails_parent_dir}/{video_id}"
+        output_npy_path = f"{features_output_dir}/{video_id}.npy"
+
+        features = np.lib.format.open_memmap(
+            f"{output_npy_path}.tmp", mode="w+", dtype=np.float32,
+            shape=(count_frames(thumbnails_dir), reduction.n_components)
+        )
+        start = 0
+        for frames in iterate_frame_batches(thumbnails_dir, batch_size):
+            features[start:start + len(frames)] = reduction.transform(frames.reshape(frames.shape[0], -1))
+            start += len(frames)
+        features.flush()
+        del features
+        os.replace(f"{output_npy_path}.tmp", output_npy_path)
+
+        # Keep the timestamps of the frames next to the features
+        frame_index_path = f"{thumbnails_dir}/{FRAME_INDEX_FILE_NAME}"
+        if os.path.exists(frame_index_path):
+            shutil.copyfile(frame_index_path, f"{features_output_dir}/{video_id}.{FRAME_INDEX_FILE_NAME}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Fit a PCA / random projection of the raw pixels on the training videos, and apply it."
+    )
+    parser.add_argument("mode", choices=["fit", "apply"], help="fit: fit and save the reduction, apply: write reduced features")
+    parser.add_argument("--thumbnails_parent_dir", type=str, required=True, help="Path to the directory of the thumbnails of every video")
+    parser.add_argument("--reduction_path", type=str, required=True, help="Path to the .npz file of the reduction")
+    parser.add_argument("--video_list_path", type=str, default=None, help="Text file of the videos to fit on, one per line (default: every video)")
+    parser.add_argument("--method", type=str, default="pca", choices=METHODS, help="Reduction method")
+    parser.add_argument("--n_components", type=int, default=256, help="Dimension after the reduction")
+    parser.add_argument("--batch_size", type=int, default=512, help="Number of frames per partial fit / projection")
+    parser.add_argument("--features_output_dir", type=str, default=None, help="Directory to save the reduced features in (apply)")
+    args = parser.parse_args()
+
+    if args.mode == "fit":
+        if args.video_list_path is not None:
+            with open(args.video_list_path, "r", encoding="utf-8") as file:
+                video_list = [line.strip() for line in file if line.strip() != ""]
+        else:
+            video_list = sorted(
+                video_id
+                for video_id in os.listdir(args.thumbnails_parent_dir)
+                if os.path.isdir(f"{args.thumbnails_parent_dir}/{video_id}")
+            )
+        fit_reduction(
+            thumbnails_parent_dir=args.thumbnails_parent_dir,
+            video_list=video_list,
+            reduction_path=args.reduction_path,
+            method=args.method,
+            n_components=args.n_components,
+            batch_size=args.batch_size,
+        )
+    else:
+        if args.features_output_dir is None:
+            parser.error("--features_output_dir is required with apply")
+        reduce_thumbnails_dir(
+            thumbnails_parent_dir=args.thumbnails_parent_dir,
+            reduction_path=args.reduction_path,
+            features_output_dir=args.features_output_dir,
+            batch_size=args.batch_size,
+        )
@@ -0,0 +1,221 @@
+import json
+import os
+import shutil
+
+import argparse
+import numpy as np
+import torch
+from torchvision import models
+from tqdm import tqdm
+
+from thumbnails_extractor import FRAME_INDEX_FILE_NAME, MANIFEST_FILE_NAME, count_frames, iterate_frame_batches
+
+# Pretrained torchvision models and the dimension of their pooled features
+ENCODERS = {
+    "resnet18": 512,
+    "resnet34": 512,
+    "resnet50": 2048,
+    "mobilenet_v3_small": 576,
+    "mobilenet_v3_large": 960,
+    "efficientnet_b0": 1280,
+}
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+
+def load_encoder(encoder: str = "resnet18") -> torch.nn.Module:
+    """
+    Load a pretrained torchvision model without its classification head.
+
+    [Arguments]
+            encoder - name of the model (see ENCODERS)
+
+    [Returns]
+            model in eval mode on CPU, returning (batch x ENCODERS[encoder]) features
+    """
+
+    if encoder not in ENCODERS:
+        raise ValueError(f"encoder has to be one of {list(ENCODERS.keys())}")
+
+    model = getattr(models, encoder)(weights="DEFAULT")
+
+    # Keep the pooled features
+    if hasattr(model, "fc"):
+        model.fc = torch.nn.Identity()
+    else:
+        model.classifier = torch.nn.Identity()
+
+    return model.eval()
+
+
+def encode_video(
+    thumbnails_dir: str,
+    output_npy_path: str,
+    model: torch.nn.Module,
+    feature_dimension: int,
+    batch_size: int = 64,
+) -> int:
+    """
+    Encode the frames of one video into a (nb_frames x feature_dimension) float16 .npy file
+
+    [Arguments]
+            thumbnails_dir - directory of the thumbnails of the video
+            output_npy_path - path to the .npy file to write
+            model - encoder returned by load_encoder
+            feature_dimension - dimension of the features of the encoder
+            batch_size - number of frames encoded at once
+
+    [Returns]
+            number of frames
+    """
+
+    nb_frames = count_frames(thumbnails_dir)
+    temp_npy_path = f"{output_npy_path}.tmp"
+    features = np.lib.format.open_memmap(
+        temp_npy_path, mode="w+", dtype=np.float16, shape=(nb_frames, feature_dimension)
+    )
+
+    mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+
+    start = 0
+    with torch.inference_mode():
+        for batch in iterate_frame_batches(thumbnails_dir, batch_size):
+
+            # BGR uint8 -> normalised RGB float
+            batch = torch.from_numpy(np.ascontiguousarray(batch[..., ::-1]))
+            batch = batch.permute(0, 3, 1, 2).float().div_(255)
+            batch = (batch - mean) / std
+
+            features[start:start + len(batch)] = model(batch).numpy().astype(np.float16)
+            start += len(batch)
+
+    features.flush()
+    del features
+    os.replace(temp_npy_path, output_npy_path)
+
+    return nb_frames
+
+
+def encode_thumbnails_dir(
+    thumbnails_parent_dir: str,
+    features_output_dir: str,
+    encoder: str = "resnet18",
+    batch_size: int = 64,
+    num_threads: int = None,
+):
+    """
+    Encode the thumbnails of every video into low-dimensional features.
+
+    [Arguments]
+            thumbnails_parent_dir - directory of the thumbnails directories of every video
+                                    (written by thumbnails_extractor.py)
+            features_output_dir - directory to save the features in ({video_id}.npy)
+            encoder - pretrained CNN (see ENCODERS)
+            batch_size - number of frames encoded at once
+            num_threads - number of CPU threads used by torch (None: torch's default)
+
+    [Returns]
+            nothing
+
+    [Explanation]
+            Flattened 320x240 thumbnails are 230,400 values per frame, which makes the input
+            layer of FACT and every transfer of the data loader huge. A pretrained CNN reduces
+            every frame to ENCODERS[encoder] values (stored as float16). Use the output
+            directory as thumbnails_dir with feature_type: npy in the configuration.
+            Every {video_id}.npy gets a {video_id}.manifest.json recording its encoder:
+            videos whose features are newer than their thumbnails and were computed by
+            the same encoder are skipped.
+    """
+
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+
+    os.makedirs(features_output_dir, exist_ok=True)
+
+    model = load_encoder(encoder)
+    feature_dimension = ENCODERS[encoder]
+
+    video_ids = sorted(
+        video_id
+        for video_id in os.listdir(thumbnails_parent_dir)
+        if os.path.isdir(f"{thumbnails_parent_dir}/{video_id}")
+    )
+
+    for video_id in tqdm(video_ids):
+
+        thumbnails_dir = f"{thumbnails_parent_dir}/{video_id}"
+        output_npy_path = f"{features_output_dir}/{video_id}.npy"
+
+        manifest_path = f"{features_output_dir}/{video_id}.{MANIFEST_FILE_NAME}"
+        manifest = {"encoder": encoder, "feature_dimension": feature_dimension}
+
+        # Skip videos already encoded (by the same encoder)
+        if os.path.exists(output_npy_path) and os.path.getmtime(output_npy_path) >= os.path.getmtime(thumbnails_dir):
+            if os.path.exists(manifest_path):
+                with open(manifest_path, "r", encoding="utf-8") as file:
+                    previous_manifest = json.load(file)
+                if {key: previous_manifest.get(key) for key in manifest} == manifest:
+                    continue
+
+        nb_frames = encode_video(thumbnails_dir, output_npy_path, model, feature_dimension, batch_size)
+
+        # Written last, so that interrupted or outdated features are encoded again
+        manifest["nb_frames"] = nb_frames
+        with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=4)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+        # Keep the timestamps of the frames next to the features
+        frame_index_path = f"{thumbnails_dir}/{FRAME_INDEX_FILE_NAME}"
+        if os.path.exists(frame_index_path):
+            shutil.copyfile(frame_index_path, f"{features_output_dir}/{video_id}.{FRAME_INDEX_FILE_NAME}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Encode the extracted thumbnails into CNN features (one .npy file per video)."
+    )
+    parser.add_argument(
+        "--thumbnails_parent_dir",
+        type=str,
+        required=True,
+        help="Path to the directory of the thumbnails of every video",
+    )
+    parser.add_argument(
+        "--features_output_dir",
+        type=str,
+        required=True,
+        help="Path to the directory to save the features",
+    )
+    parser.add_argument(
+        "--encoder",
+        type=str,
+        default="resnet18",
+        choices=list(ENCODERS.keys()),
+        help="Pretrained CNN used to encode the frames",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=64,
+        help="Number of frames encoded at once",
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=None,
+        help="Number of CPU threads used by torch",
+    )
+
+    args = parser.parse_args()
+
+    encode_thumbnails_dir(
+        thumbnails_parent_dir=args.thumbnails_parent_dir,
+        features_output_dir=args.features_output_dir,
+        encoder=args.encoder,
+        batch_size=args.batch_size,
+        num_threads=args.num_threads,
+    )
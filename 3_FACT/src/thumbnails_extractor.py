@@ -1,17 +1,386 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import json
 import os
 from pathlib import Path
+import queue
+import re
+import shutil
+import subprocess
+import threading
+import time
 
 import argparse
 import cv2
 import numpy as np
 from tqdm import tqdm
 
+# Written in every thumbnails directory once all its frames are extracted
+MANIFEST_FILE_NAME = "manifest.json"
+
+# Packed output: uint8 array of the frames (nb_frames x height x width x 3)
+# and index of their frame numbers and timestamps
+PACKED_FRAMES_FILE_NAME = "frames.npy"
+FRAME_INDEX_FILE_NAME = "frame_index.csv"
+
+OUTPUT_FORMATS = ["npy", "jpg", "both"]
+
+# uniform: every 1 / sampling_fps seconds, scene: at scene changes (see iterate_scene_change_frames)
+SAMPLING_MODES = ["uniform", "scene"]
+
+# opencv: iterate_sampled_frames, ffmpeg: iterate_sampled_frames_ffmpeg,
+# auto: ffmpeg if it is installed, falling back to opencv if it fails
+BACKENDS = ["auto", "ffmpeg", "opencv"]
+
+# Parameters that do not change the extracted frames: ignored when comparing manifests.
+# The backend does (scaling and colour conversion differ slightly), and is compared on the
+# backend actually used (see extract_video)
+DECODING_PARAMETERS = ["backend", "ffmpeg_threads"]
+
+
+def iterate_sampled_frames(
+    video_path: str, sampling_fps: float = 1, seek_threshold_secs: float = 30
+):
+    """
+    Decode a video in a single sequential pass and yield the sampled frames.
+
+    [Arguments]
+            video_path - path to the video file
+            sampling_fps - number of frames sampled per second of video
+            seek_threshold_secs - seek instead of grabbing when the next sampled
+                                  frame is further away than that
+
+    [Returns]
+            generator of (frame_nb, timestamp_secs, frame)
+
+    [Explanation]
+            Seeking (cap.set(cv2.CAP_PROP_POS_FRAMES, ...)) before every sampled frame
+            makes the decoder restart from the previous keyframe each time. Here every
+            frame is grabbed (demuxed and decoded once, in order), and only the sampled
+            ones are retrieved (converted to BGR images).
+            Frames are sampled on their timestamps rather than on their numbers, so that
+            variable frame rate videos are sampled every 1 / sampling_fps seconds as well:
+            a frame is kept as soon as its timestamp reaches the next sampling time.
+            Very sparse sampling (e.g. one frame per minute) is still faster with a seek,
+            which only decodes from the previous keyframe (a few seconds on YouTube).
+    """
+
+    # Open the video file
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video: {video_path}")
+
+    # Fallback if the backend does not report timestamps
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    sampling_interval = 1 / sampling_fps
+
+    next_sampling_time = 0.0
+    try:
+        while cap.grab():
+
+            # Number and timestamp of the grabbed frame
+            frame_nb = int(cap.get(cv2.CAP_PROP_POS_FRAMES)) - 1
+            timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if timestamp <= 0 and frame_nb > 0:
+                timestamp = frame_nb / fps
+
+            if timestamp + 1e-6 < next_sampling_time:
+                continue
+
+            # Decode the sampled frame only
+            success, frame = cap.retrieve()
+            if not success:
+                continue
+
+            yield frame_nb, timestamp, frame
+
+            # Skip the sampling times missed in a gap of the video
+            next_sampling_time += sampling_interval
+            if next_sampling_time <= timestamp:
+                next_sampling_time = (int(timestamp / sampling_interval) + 1) * sampling_interval
+
+            # Jump to the next sampled frame
+            if next_sampling_time - timestamp > seek_threshold_secs:
+                cap.set(cv2.CAP_PROP_POS_MSEC, next_sampling_time * 1000)
+    finally:
+        cap.release()
+
+
+def iterate_sampled_frames_ffmpeg(
+    video_path: str,
+    sampling_fps: float = 1,
+    thumbnails_resolution: tuple = (320, 240),
+    ffmpeg_threads: int = 0,
+    ffmpeg_fast_decode: bool = False,
+):
+    """
+    Decode a video with ffmpeg and yield the sampled frames, already resized.
+
+    [Arguments]
+            video_path - path to the video file
+            sampling_fps - number of frames sampled per second of video
+            thumbnails_resolution - resolution of the yielded frames
+            ffmpeg_threads - number of decoding threads (0: chosen by ffmpeg)
+            ffmpeg_fast_decode - skip the deblocking filter and the non-reference frames
+
+    [Returns]
+            generator of (frame_nb, timestamp_secs, frame)
+
+    [Explanation]
+            With OpenCV, every sampled frame is converted to BGR at the source
+            resolution (e.g. 1920x1080) and then resized. Here the frames are selected,
+            scaled and only then converted to BGR inside ffmpeg's filter graph, and
+            decoding is multithreaded. Frames are read from a raw video pipe; their
+            timestamps come from the showinfo filter (on stderr), and their frame
+            numbers are derived from the timestamps and the frame rate of the video.
+            Frames are selected on the same grid as iterate_sampled_frames, so both
+            backends extract the same frames.
+            Decoding every frame still dominates, so with ffmpeg_fast_decode the decoder
+            also skips the deblocking filter (invisible once downscaled) and the frames
+            no other frame depends on, about twice as fast. A sampled frame may then move
+            to a neighbouring frame (the reported timestamps stay exact), so the frames
+            differ from those of OpenCV: it is off by default.
+    """
+
+    width, height = thumbnails_resolution
+    frame_size = width * height * 3
+
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    cap.release()
+
+    # Same grid as iterate_sampled_frames: the first frame at or after every k / sampling_fps seconds
+    interval = f"{1 / sampling_fps:.9f}"
+    filters = (
+        f"select='isnan(prev_selected_t)+gt(floor((t+1e-6)/{interval})\\,floor((prev_selected_t+1e-6)/{interval}))',"
+        f"scale={width}:{height}:flags=area,showinfo"
+    )
+    command = ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "info", "-threads", str(ffmpeg_threads)]
+    if ffmpeg_fast_decode:
+        command += ["-flags2", "fast", "-skip_loop_filter", "all", "-skip_frame", "noref"]
+    command += [
+        "-i", video_path,
+        "-an", "-sn",
+        "-vf", filters,
+        "-vsync", "vfr",
+        "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1",
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    # Timestamps printed by showinfo, in the order of the frames
+    timestamps = queue.Queue()
+    stderr_tail = deque(maxlen=5)
+
+    def read_stderr():
+        for line in process.stderr:
+            line = line.decode("utf-8", errors="replace")
+            match = re.search(r"Parsed_showinfo.*pts_time:\s*([-0-9.]+)", line)
+            if match:
+                timestamps.put(float(match.group(1)))
+            else:
+                stderr_tail.append(line.strip())
+
+    stderr_reader = threading.Thread(target=read_stderr, daemon=True)
+    stderr_reader.start()
+
+    try:
+        while True:
+            buffer = process.stdout.read(frame_size)
+            if len(buffer) < frame_size:
+                break
+            frame = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+            try:
+                timestamp = timestamps.get(timeout=60)
+            except queue.Empty:
+                raise RuntimeError(f"ffmpeg did not report the timestamp of a frame of {video_path}")
+            yield int(round(timestamp * fps)), timestamp, frame
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        stderr_reader.join(timeout=5)
+
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed on {video_path}: {' / '.join(stderr_tail)}")
+
+
+def iterate_video_frames(
+    video_path: str,
+    sampling_fps: float = 1,
+    thumbnails_resolution: tuple = (320, 240),
+    backend: str = "opencv",
+    ffmpeg_threads: int = 0,
+    ffmpeg_fast_decode: bool = False,
+):
+    """
+    Sampled frames of a video, decoded with the given backend ("opencv" or "ffmpeg")
+    """
+
+    if backend == "ffmpeg":
+        return iterate_sampled_frames_ffmpeg(
+            video_path, sampling_fps, thumbnails_resolution, ffmpeg_threads, ffmpeg_fast_decode
+        )
+    return iterate_sampled_frames(video_path, sampling_fps)
+
+
+def iterate_scene_change_frames(
+    frames,
+    min_sampling_fps: float = 1 / 30,
+    scene_threshold: float = 10,
+):
+    """
+    Select the frames where the content changes.
+
+    [Arguments]
+            frames - generator of (frame_nb, timestamp_secs, frame) sampled at the
+                     maximum sampling rate (see iterate_sampled_frames)
+            min_sampling_fps - minimum sampling rate, during static stretches
+            scene_threshold - mean absolute difference (0-255) between two downscaled
+                              grayscale frames from which a frame is kept
+
+    [Returns]
+            generator of (frame_nb, timestamp_secs, frame)
+
+    [Explanation]
+            Wayang kulit performances alternate long static stretches and short
+            bursts of movement. Every candidate frame is reduced to a 32x18 grayscale
+            signature and compared to the signature of the last kept frame: it is kept
+            if the content drifted by more than scene_threshold, or if no frame was
+            kept for 1 / min_sampling_fps seconds. Boundaries are kept at the precision
+            of the candidate frames, with far fewer frames.
+    """
+
+    last_signature = None
+    last_timestamp = None
+    for frame_nb, timestamp, frame in frames:
+
+        signature = cv2.resize(frame, (32, 18), interpolation=cv2.INTER_AREA)
+        signature = cv2.cvtColor(signature, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+        if (
+            last_signature is None
+            or timestamp - last_timestamp >= 1 / min_sampling_fps - 1e-6
+            or np.abs(signature - last_signature).mean() >= scene_threshold
+        ):
+            last_signature = signature
+            last_timestamp = timestamp
+            yield frame_nb, timestamp, frame
+
+
+def get_thumbnails_dir_name(
+    sampling_fps: float,
+    thumbnails_resolution: tuple,
+    sampling_mode: str = "uniform",
+    min_sampling_fps: float = None,
+    scene_threshold: float = None,
+) -> str:
+    if sampling_mode == "scene":
+        return f"thumbnails_scene{scene_threshold:g}_{min_sampling_fps:g}-{sampling_fps:g}fps_{thumbnails_resolution[0]}px{thumbnails_resolution[1]}px"
+    return f"thumbnails_{sampling_fps:g}fps_{thumbnails_resolution[0]}px{thumbnails_resolution[1]}px"
+
+
+class PackedFrameWriter:
+    """
+    Write frames into one preallocated, memory-mapped .npy file.
+
+    [Arguments]
+            path - path to the .npy file
+            frame_shape - shape of a frame (height, width, 3)
+            capacity - expected number of frames
+
+    [Explanation]
+            The file is preallocated with np.lib.format.open_memmap for the expected
+            number of frames (from the duration of the video), so frames are copied
+            straight into the page cache. If the video has more frames than expected,
+            the capacity is doubled (copy into a new file); on close(), the array is
+            shrunk in place to the actual number of frames by rewriting its header
+            and truncating the file.
+    """
+
+    def __init__(self, path: str, frame_shape: tuple, capacity: int):
+        self.path = path
+        self.frame_shape = tuple(frame_shape)
+        self.nb_frames = 0
+        self.array = np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.uint8, shape=(max(1, capacity),) + self.frame_shape
+        )
+
+    def append(self, frame: np.ndarray):
+        if self.nb_frames == self.array.shape[0]:
+            self._grow()
+        self.array[self.nb_frames] = frame
+        self.nb_frames += 1
+
+    def close(self) -> int:
+        self.array.flush()
+        capacity = self.array.shape[0]
+        del self.array
+        if self.nb_frames != capacity:
+            _shrink_npy(self.path, (self.nb_frames,) + self.frame_shape)
+        return self.nb_frames
+
+    def _grow(self):
+        temp_path = f"{self.path}.tmp.npy"
+        array = np.lib.format.open_memmap(
+            temp_path, mode="w+", dtype=np.uint8, shape=(2 * self.array.shape[0],) + self.frame_shape
+        )
+        array[: self.nb_frames] = self.array
+        del self.array
+        os.replace(temp_path, self.path)
+        self.array = array
+
+
+def _shrink_npy(path: str, shape: tuple):
+    """
+    Reduce the first dimension of a .npy file without copying its data
+    """
+
+    with open(path, "r+b") as file:
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            _, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            _, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        data_offset = file.tell()
+
+        # New header, padded to the length of the previous one
+        header = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": fortran_order, "shape": tuple(shape)})
+        prefix_length = 10 if version == (1, 0) else 12
+        header = header.ljust(data_offset - prefix_length - 1) + "\n"
+        file.seek(prefix_length)
+        file.write(header.encode("latin1"))
+
+        file.truncate(data_offset + int(np.prod(shape)) * dtype.itemsize)
+
+
+def estimate_nb_sampled_frames(video_path: str, sampling_fps: float) -> int:
+    """
+    Expected number of sampled frames, from the duration in the container metadata
+    """
+
+    cap = cv2.VideoCapture(video_path)
+    total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+
+    if total_frames <= 0 or fps <= 0:
+        return 1024
+    return int(total_frames / fps * sampling_fps) + 2
+
 
 def extract_frames_every_n_seconds(
     video_path: str,
     thumbnails_output_dir: str,
     sampling_fps: float = 1,
     thumbnails_resolution: tuple = (320, 240),
+    output_format: str = "npy",
+    sampling_mode: str = "uniform",
+    min_sampling_fps: float = 1 / 30,
+    scene_threshold: float = 10,
+    backend: str = "auto",
+    ffmpeg_threads: int = 0,
+    ffmpeg_fast_decode: bool = False,
 ):
     """
     Extract frames from a video every n seconds.
@@ -21,53 +390,339 @@ def extract_frames_every_n_seconds(
             thumbnails_output_dir - directory to save the thumbnails
             sampling_fps - interval between frames
             thumbnails_resolution - thumbnails_resolution of the thumbnails
+            output_format - "npy": frames packed in PACKED_FRAMES_FILE_NAME,
+                            "jpg": one JPEG per frame (e.g. for previews), "both"
+            sampling_mode - "uniform" or "scene" (sampling_fps is then the maximum rate,
+                            see iterate_scene_change_frames for the other parameters)
+            backend - "opencv", "ffmpeg" (decode-time scaling, see iterate_sampled_frames_ffmpeg)
+                      or "auto" (ffmpeg if installed, falling back to opencv if it fails)
+            ffmpeg_threads - number of decoding threads of ffmpeg (0: chosen by ffmpeg)
+            ffmpeg_fast_decode - see iterate_sampled_frames_ffmpeg
 
     [Returns]
-            nothing
+            number of extracted frames
+
+    [Explanation]
+            The packed array avoids encoding every frame to JPEG and decoding it again
+            in convert_images_to_np_array or dataset.load_thumbnails (and millions of
+            small files). In every format, FRAME_INDEX_FILE_NAME lists the frame number
+            and timestamp of every extracted frame, which maps the samples back to the
+            time of the video (needed with the scene sampling mode).
+    """
+
+    nb_frames, _ = _extract_frames(
+        video_path, thumbnails_output_dir, sampling_fps, thumbnails_resolution, output_format,
+        sampling_mode, min_sampling_fps, scene_threshold, backend, ffmpeg_threads, ffmpeg_fast_decode,
+    )
+    return nb_frames
+
+
+def _extract_frames(
+    video_path: str,
+    thumbnails_output_dir: str,
+    sampling_fps: float = 1,
+    thumbnails_resolution: tuple = (320, 240),
+    output_format: str = "npy",
+    sampling_mode: str = "uniform",
+    min_sampling_fps: float = 1 / 30,
+    scene_threshold: float = 10,
+    backend: str = "auto",
+    ffmpeg_threads: int = 0,
+    ffmpeg_fast_decode: bool = False,
+) -> tuple:
+    """
+    extract_frames_every_n_seconds, also returning the backend used
+
+    [Returns]
+            (number of extracted frames, backend actually used: "ffmpeg" or "opencv")
     """
 
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format has to be one of {OUTPUT_FORMATS}")
+    if sampling_mode not in SAMPLING_MODES:
+        raise ValueError(f"sampling_mode has to be one of {SAMPLING_MODES}")
+    if backend not in BACKENDS:
+        raise ValueError(f"backend has to be one of {BACKENDS}")
+
     # Create the output directory if it doesn't exist
-    thumbnails_output_dir = f"{thumbnails_output_dir}"
     if not os.path.exists(thumbnails_output_dir):
         os.makedirs(thumbnails_output_dir)
 
-    # Open the video file
-    cap = cv2.VideoCapture(video_path)
+    def extract(selected_backend):
+        frames = iterate_video_frames(
+            video_path, sampling_fps, thumbnails_resolution, selected_backend, ffmpeg_threads, ffmpeg_fast_decode
+        )
+        if sampling_mode == "scene":
+            frames = iterate_scene_change_frames(frames, min_sampling_fps, scene_threshold)
+        nb_frames = _write_frames(frames, video_path, thumbnails_output_dir, sampling_fps, thumbnails_resolution, output_format)
+        return nb_frames, selected_backend
 
-    # Get video properties
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_interval = int(fps / sampling_fps)  # Seconds between frames
+    if backend != "auto":
+        return extract(backend)
+    if shutil.which("ffmpeg") is None:
+        return extract("opencv")
 
-    # Counter
-    for frame_nb in range(0, total_frames, frame_interval):
+    try:
+        return extract("ffmpeg")
+    except RuntimeError as error:
+        print(f"{error} -- falling back to OpenCV")
+        for file_name in os.listdir(thumbnails_output_dir):
+            os.remove(f"{thumbnails_output_dir}/{file_name}")
+        return extract("opencv")
 
-        # Get frame
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_nb)
 
-        # Read frame
-        success, frame = cap.read()
-        if not success:
-            continue
+def _write_frames(
+    frames,
+    video_path: str,
+    thumbnails_output_dir: str,
+    sampling_fps: float,
+    thumbnails_resolution: tuple,
+    output_format: str,
+) -> int:
 
-        # Resize
-        frame = cv2.resize(frame, thumbnails_resolution)
+    writer = None
+    if output_format in ["npy", "both"]:
+        writer = PackedFrameWriter(
+            f"{thumbnails_output_dir}/{PACKED_FRAMES_FILE_NAME}",
+            (thumbnails_resolution[1], thumbnails_resolution[0], 3),
+            estimate_nb_sampled_frames(video_path, sampling_fps),
+        )
 
-        # Save frame
-        cv2.imwrite(
-            f"{thumbnails_output_dir}/{str(frame_nb).zfill(7)}.jpg", frame)
+    # Single sequential pass over the video
+    nb_frames = 0
+    with open(f"{thumbnails_output_dir}/{FRAME_INDEX_FILE_NAME}", "w", encoding="utf-8") as index_file:
+        index_file.write("frame_nb,timestamp_secs\n")
 
-    cap.release()
+        for frame_nb, timestamp, frame in frames:
+
+            # Resize (frames from ffmpeg are already resized)
+            if frame.shape[1::-1] != tuple(thumbnails_resolution):
+                frame = cv2.resize(frame, thumbnails_resolution, interpolation=cv2.INTER_AREA)
+
+            # Save frame
+            if writer is not None:
+                writer.append(frame)
+            if output_format in ["jpg", "both"]:
+                cv2.imwrite(
+                    f"{thumbnails_output_dir}/{str(frame_nb).zfill(7)}.jpg", frame)
+            index_file.write(f"{frame_nb},{timestamp:.3f}\n")
+            nb_frames += 1
+
+    if writer is not None:
+        writer.close()
+
+    return nb_frames
+
+
+def get_manifest(video_path: str, parameters: dict) -> dict:
+    """
+    Describe the extraction of a video: source file and the parameters defining the frames
+    extracted (not the DECODING_PARAMETERS, so that changing them does not redo the corpus;
+    the backend actually used is added by extract_video).
+
+    [Returns]
+            dictionary written to MANIFEST_FILE_NAME (without the frame count and the backend used)
+    """
+
+    stat = os.stat(video_path)
+    manifest = {
+        "source": os.path.abspath(video_path),
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime,
+    }
+    for key, value in parameters.items():
+        if key not in DECODING_PARAMETERS:
+            manifest[key] = list(value) if isinstance(value, tuple) else value
+    return manifest
+
+
+def read_manifest(thumbnails_output_dir: str) -> dict:
+    manifest_path = f"{thumbnails_output_dir}/{MANIFEST_FILE_NAME}"
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def extract_video(video_path: str, thumbnails_output_dir: str, **parameters) -> tuple:
+    """
+    Extract frames from a video, unless its manifest shows it was already done.
+
+    [Arguments]
+            video_path - path to the video file
+            thumbnails_output_dir - directory to save the thumbnails
+            parameters - other arguments of extract_frames_every_n_seconds
+                         (sampling_fps, thumbnails_resolution, output_format...)
+
+    [Returns]
+            (video_path, number of frames, whether the video was skipped)
+
+    [Explanation]
+            The manifest is written last, so a directory without a manifest (or with
+            the manifest of another source file or of other parameters) was interrupted
+            or is outdated: its frames are deleted and the video is extracted again.
+            The manifest records the backend actually used, so that a corpus is not
+            resumed with another backend ("auto" resolves to ffmpeg if it is installed,
+            and also accepts the videos on which ffmpeg failed before).
+    """
+
+    manifest = get_manifest(video_path, parameters)
+    backend = parameters.get("backend", "auto")
+    expected_backend = backend
+    if backend == "auto":
+        expected_backend = "ffmpeg" if shutil.which("ffmpeg") is not None else "opencv"
+
+    # Skip completed videos
+    previous_manifest = read_manifest(thumbnails_output_dir)
+    if previous_manifest is not None:
+        nb_frames = previous_manifest.pop("nb_frames", None)
+        previous_manifest.pop("completed_at", None)
+        previous_backend = previous_manifest.get("backend")
+        ffmpeg_failed = previous_manifest.pop("ffmpeg_failed", False)
+        for key in DECODING_PARAMETERS:
+            previous_manifest.pop(key, None)
+        same_backend = previous_backend in [expected_backend, backend] or (backend == "auto" and ffmpeg_failed)
+        if previous_manifest == manifest and same_backend:
+            return video_path, nb_frames, True
+
+    # Redo half-finished videos from scratch
+    if os.path.exists(thumbnails_output_dir):
+        for file_name in os.listdir(thumbnails_output_dir):
+            os.remove(f"{thumbnails_output_dir}/{file_name}")
+
+    nb_frames, used_backend = _extract_frames(video_path, thumbnails_output_dir, **parameters)
+
+    # Write the manifest atomically
+    manifest["backend"] = used_backend
+    if used_backend != expected_backend:
+        manifest["ffmpeg_failed"] = True
+    manifest["nb_frames"] = nb_frames
+    manifest["completed_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    manifest_path = f"{thumbnails_output_dir}/{MANIFEST_FILE_NAME}"
+    with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    return video_path, nb_frames, False
+
+
+def list_thumbnails(thumbnails_dir: str) -> list:
+    """
+    Sorted file names of the thumbnails of a video (without the manifest)
+    """
+    return sorted(f for f in os.listdir(thumbnails_dir) if f.endswith(".jpg"))
+
+
+def iterate_frame_batches(thumbnails_dir: str, batch_size: int):
+    """
+    Yield batches of frames (batch x height x width x 3, uint8 BGR) of a video,
+    from the packed array of thumbnails_extractor.py or from its JPEGs
+    """
+
+    packed_frames_path = f"{thumbnails_dir}/{PACKED_FRAMES_FILE_NAME}"
+    if os.path.exists(packed_frames_path):
+        frames = np.load(packed_frames_path, mmap_mode="r")
+        for start in range(0, frames.shape[0], batch_size):
+            yield np.asarray(frames[start:start + batch_size])
+        return
+
+    thumbnails = list_thumbnails(thumbnails_dir)
+    for start in range(0, len(thumbnails), batch_size):
+        yield np.stack([
+            cv2.imread(f"{thumbnails_dir}/{thumbnail}")
+            for thumbnail in thumbnails[start:start + batch_size]
+        ])
+
+
+def count_frames(thumbnails_dir: str) -> int:
+    packed_frames_path = f"{thumbnails_dir}/{PACKED_FRAMES_FILE_NAME}"
+    if os.path.exists(packed_frames_path):
+        return np.load(packed_frames_path, mmap_mode="r").shape[0]
+    return len(list_thumbnails(thumbnails_dir))
+
+
+def convert_video_thumbnails_to_np_array(
+    thumbnails_dir: str, output_npy_path: str, read_ahead: int = 16
+) -> int:
+    """
+    Convert the thumbnails of one video to a (nb_frames x flattened frame) uint8 .npy file
+
+    [Arguments]
+            thumbnails_dir - directory of the thumbnails of the video
+            output_npy_path - path to the .npy file to write
+            read_ahead - number of thumbnails read in advance (by a background thread)
+
+    [Returns]
+            number of frames
+
+    [Explanation]
+            The output is preallocated with np.lib.format.open_memmap (the number of
+            thumbnails and the size of the first one give its shape) and filled row by
+            row, so that the memory used is one frame plus the read-ahead buffer instead
+            of a list of every frame followed by a second copy made by np.array.
+    """
+
+    temp_npy_path = f"{output_npy_path}.tmp"
+
+    # Frames already packed by the extractor
+    packed_frames_path = f"{thumbnails_dir}/{PACKED_FRAMES_FILE_NAME}"
+    if os.path.exists(packed_frames_path):
+        frames = np.load(packed_frames_path, mmap_mode="r")
+        output = np.lib.format.open_memmap(
+            temp_npy_path, mode="w+", dtype=np.uint8, shape=(frames.shape[0], int(np.prod(frames.shape[1:])))
+        )
+        for start in range(0, frames.shape[0], read_ahead):
+            output[start:start + read_ahead] = frames[start:start + read_ahead].reshape(-1, output.shape[1])
+
+    else:
+        thumbnails = list_thumbnails(thumbnails_dir)
+
+        # Still write an empty (0 x frame size) array, as the loaders expect every {video_id}.npy
+        if len(thumbnails) == 0:
+            manifest = read_manifest(thumbnails_dir)
+            frame_size = 0
+            if manifest is not None and "thumbnails_resolution" in manifest:
+                frame_size = manifest["thumbnails_resolution"][0] * manifest["thumbnails_resolution"][1] * 3
+            np.save(output_npy_path, np.empty((0, frame_size), dtype=np.uint8))
+            return 0
+
+        frame_size = cv2.imread(f"{thumbnails_dir}/{thumbnails[0]}").size
+        output = np.lib.format.open_memmap(
+            temp_npy_path, mode="w+", dtype=np.uint8, shape=(len(thumbnails), frame_size)
+        )
+
+        # Read and flatten (cv2.imread releases the GIL, so reads overlap with the copies)
+        with ThreadPoolExecutor(max_workers=1) as reader:
+            pending = deque()
+            for i, thumbnail in enumerate(thumbnails):
+                pending.append(reader.submit(cv2.imread, f"{thumbnails_dir}/{thumbnail}"))
+                if len(pending) > read_ahead:
+                    output[i - read_ahead] = pending.popleft().result().reshape(-1)
+            for i in range(len(thumbnails) - len(pending), len(thumbnails)):
+                output[i] = pending.popleft().result().reshape(-1)
+
+    nb_frames = output.shape[0]
+    output.flush()
+    del output
+    os.replace(temp_npy_path, output_npy_path)
+
+    return nb_frames
 
 
 def convert_images_to_np_array(
-    thumbnails_parent_dir: str, thumbnails_npy_output_dir: str
+    thumbnails_parent_dir: str,
+    thumbnails_npy_output_dir: str,
+    num_workers: int = 1,
+    read_ahead: int = 16,
 ):
     """
     Convert images to numpy array
 
     [Arguments]
-            image_path - path to the image file
+            thumbnails_parent_dir - directory of the thumbnails directories of every video
+            thumbnails_npy_output_dir - directory to save the npy files in
+            num_workers - number of videos converted in parallel (one process per video)
+            read_ahead - number of thumbnails read in advance for every video
 
     [Returns]
             nothing. Writes to npy file
@@ -79,28 +734,28 @@ def convert_images_to_np_array(
         os.makedirs(thumbnails_npy_output_dir)
 
     # Grab list of directories in the thumbnails directory
-    thumbnails_dirs = os.listdir(thumbnails_parent_dir)
+    thumbnails_dirs = [
+        video_id
+        for video_id in os.listdir(thumbnails_parent_dir)
+        if os.path.isdir(f"{thumbnails_parent_dir}/{video_id}")
+    ]
     thumbnails_dirs.sort()
 
+    jobs = [
+        (f"{thumbnails_parent_dir}/{video_id}", f"{thumbnails_npy_output_dir}/{video_id}.npy", read_ahead)
+        for video_id in thumbnails_dirs
+    ]
+
     # Loop through every videos' thumbnails
-    for video_id in thumbnails_dirs:
-
-        # Read the thumbnails
-        thumbnails = os.listdir(f"{thumbnails_parent_dir}/{video_id}")
-        thumbnails.sort()
-
-        # Read and flatten
-        thumbnails_array = []
-        for thumbnail in thumbnails:
-            thumbnail_path = f"{thumbnails_parent_dir}/{video_id}/{thumbnail}"
-            thumbnail_array = cv2.imread(thumbnail_path)
-            thumbnails_array.append(thumbnail_array.flatten())
-
-        # Save the thumbnails as npy
-        np.save(
-            f"{thumbnails_npy_output_dir}/{video_id}.npy", np.array(
-                thumbnails_array)
-        )
+    if num_workers <= 1:
+        for job in tqdm(jobs):
+            convert_video_thumbnails_to_np_array(*job)
+        return
+
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=cv2.setNumThreads, initargs=(1,)) as executor:
+        futures = [executor.submit(convert_video_thumbnails_to_np_array, *job) for job in jobs]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
 
 
 def extract_frames_every_n_seconds_dir(
@@ -108,7 +763,35 @@ def extract_frames_every_n_seconds_dir(
     thumbnails_output_parent_dir: str,
     sampling_fps: float = 15,
     thumbnails_resolution: tuple = (320, 240),
+    num_workers: int = 1,
+    output_format: str = "npy",
+    sampling_mode: str = "uniform",
+    min_sampling_fps: float = 1 / 30,
+    scene_threshold: float = 10,
+    backend: str = "auto",
+    ffmpeg_threads: int = 0,
+    ffmpeg_fast_decode: bool = False,
 ):
+    """
+    Extract frames from every video of a directory.
+
+    [Arguments]
+            videos_parent_dir - directory containing the videos
+            thumbnails_output_parent_dir - directory to save the thumbnails
+            sampling_fps - interval between frames
+            thumbnails_resolution - thumbnails_resolution of the thumbnails
+            num_workers - number of videos extracted in parallel (one process per video)
+            output_format, sampling_mode, min_sampling_fps, scene_threshold,
+            backend, ffmpeg_threads, ffmpeg_fast_decode - see extract_frames_every_n_seconds
+
+    [Returns]
+            nothing
+
+    [Explanation]
+            Decoding a video is mostly sequential, so the videos are spread over a
+            pool of processes instead. Videos whose manifest matches the source file
+            and the parameters are skipped, so an interrupted run can be restarted.
+    """
 
     # Go to videos_parent_dir and list all videos
     videos = [
@@ -116,29 +799,157 @@ def extract_frames_every_n_seconds_dir(
         for f in os.listdir(videos_parent_dir)
         if f.endswith(".mp4") or f.endswith(".avi")
     ]
-    thumbnails_dir_name = f"thumbnails_{sampling_fps}fps_{thumbnails_resolution[0]}px{thumbnails_resolution[1]}px"
+    thumbnails_dir_name = get_thumbnails_dir_name(
+        sampling_fps, thumbnails_resolution, sampling_mode, min_sampling_fps, scene_threshold
+    )
+    parameters = dict(
+        sampling_fps=sampling_fps,
+        thumbnails_resolution=thumbnails_resolution,
+        output_format=output_format,
+        sampling_mode=sampling_mode,
+        min_sampling_fps=min_sampling_fps,
+        scene_threshold=scene_threshold,
+        backend=backend,
+        ffmpeg_threads=ffmpeg_threads,
+        ffmpeg_fast_decode=ffmpeg_fast_decode,
+    )
+
+    # Define local parameters
+    jobs = [
+        dict(
+            video_path=f"{videos_parent_dir}/{video}",
+            thumbnails_output_dir=f"{thumbnails_output_parent_dir}/{thumbnails_dir_name}/{Path(video).stem}",
+            **parameters,
+        )
+        for video in videos
+    ]
 
     # Iterate over all videos
-    for video in tqdm(videos):
+    if num_workers <= 1:
+        for job in tqdm(jobs):
+            print(f"Processing video: {job['video_path']}")
+            extract_video(**job)
+        return
 
-        print(f"Processing video: {video}")
+    # One video per process (OpenCV's own threads would only compete with the other processes)
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=cv2.setNumThreads, initargs=(1,)) as executor:
+        futures = [executor.submit(extract_video, **job) for job in jobs]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            video_path, nb_frames, skipped = future.result()
+            print(f"{'Skipped' if skipped else 'Processed'} video: {video_path} ({nb_frames} frames)")
 
-        # Get video ID
-        video_id = Path(video).stem
 
-        # Define local parameters
-        video_path = f"{videos_parent_dir}/{video}"
-        thumbnails_output_dir = (
-            f"{thumbnails_output_parent_dir}/{thumbnails_dir_name}/{video_id}"
-        )
+def extract_frames_from_queue(
+    extraction_queue_path: str,
+    thumbnails_output_parent_dir: str,
+    sampling_fps: float = 15,
+    thumbnails_resolution: tuple = (320, 240),
+    delete_source: bool = False,
+    poll_secs: float = 5,
+    output_format: str = "npy",
+    sampling_mode: str = "uniform",
+    min_sampling_fps: float = 1 / 30,
+    scene_threshold: float = 10,
+    backend: str = "auto",
+    ffmpeg_threads: int = 0,
+    ffmpeg_fast_decode: bool = False,
+):
+    """
+    Extract frames from the videos as soon as they are downloaded.
 
-        # Extract frames from video
-        extract_frames_every_n_seconds(
-            video_path=video_path,
-            thumbnails_output_dir=thumbnails_output_dir,
-            sampling_fps=sampling_fps,
-            thumbnails_resolution=thumbnails_resolution,
-        )
+    [Arguments]
+            extraction_queue_path - queue file written by 1_YouTubeAPI/src/download_manager.py
+                                    (--extraction_queue_path)
+            thumbnails_output_parent_dir - directory to save the thumbnails
+            sampling_fps - interval between frames
+            thumbnails_resolution - thumbnails_resolution of the thumbnails
+            delete_source - delete every video once its frames are extracted
+            poll_secs - time between two checks of the queue file
+            output_format, sampling_mode, min_sampling_fps, scene_threshold,
+            backend, ffmpeg_threads, ffmpeg_fast_decode - see extract_frames_every_n_seconds
+
+    [Returns]
+            nothing
+
+    [Explanation]
+            The download manager appends the path of every downloaded video to the
+            queue file (and __END__ once all the downloads are finished). Processed
+            videos are appended to {extraction_queue_path}.done, which the download
+            manager reads to limit the number of videos waiting for extraction
+            (--max_pending_extractions). With delete_source, only those videos are on
+            disk at any time, instead of the whole corpus.
+            The .done file makes the extraction resumable.
+            Videos that cannot be extracted (e.g. corrupt downloads) are appended to
+            {extraction_queue_path}.failed instead, and kept on disk for inspection;
+            remove them from the .failed file to retry them in the next run.
+    """
+
+    end_of_queue = "__END__"
+    done_path = f"{extraction_queue_path}.done"
+    failed_path = f"{extraction_queue_path}.failed"
+    thumbnails_dir_name = get_thumbnails_dir_name(
+        sampling_fps, thumbnails_resolution, sampling_mode, min_sampling_fps, scene_threshold
+    )
+    parameters = dict(
+        sampling_fps=sampling_fps,
+        thumbnails_resolution=thumbnails_resolution,
+        output_format=output_format,
+        sampling_mode=sampling_mode,
+        min_sampling_fps=min_sampling_fps,
+        scene_threshold=scene_threshold,
+        backend=backend,
+        ffmpeg_threads=ffmpeg_threads,
+        ffmpeg_fast_decode=ffmpeg_fast_decode,
+    )
+
+    while True:
+
+        # Read the queue and the videos already processed
+        queue = _read_lines(extraction_queue_path)
+        done = set(_read_lines(done_path)) | set(_read_lines(failed_path))
+        video_paths = [path for path in queue if path != end_of_queue and path not in done]
+
+        # Wait for the next download
+        if len(video_paths) == 0:
+            if end_of_queue in queue:
+                break
+            time.sleep(poll_secs)
+            continue
+
+        for video_path in video_paths:
+
+            print(f"Processing video: {video_path}")
+
+            # Get video ID
+            video_id = Path(video_path).stem
+
+            # Extract frames from video
+            try:
+                extract_video(
+                    video_path=video_path,
+                    thumbnails_output_dir=f"{thumbnails_output_parent_dir}/{thumbnails_dir_name}/{video_id}",
+                    **parameters,
+                )
+            except Exception as error:
+                # Skip the video, so that the downloader waiting on the queue keeps going
+                print(f"Failed to extract frames from {video_path}: {error!r}")
+                with open(failed_path, "a", encoding="utf-8") as file:
+                    file.write(f"{video_path}\n")
+                continue
+
+            # Free the disk space before marking the video as done
+            if delete_source and os.path.exists(video_path):
+                os.remove(video_path)
+
+            with open(done_path, "a", encoding="utf-8") as file:
+                file.write(f"{video_path}\n")
+
+
+def _read_lines(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip() != ""]
 
 
 if __name__ == "__main__":
@@ -149,9 +960,20 @@ if __name__ == "__main__":
     parser.add_argument(
         "--videos_parent_dir",
         type=str,
-        required=True,
+        default=None,
         help="Path to the directory containing all the videos",
     )
+    parser.add_argument(
+        "--extraction_queue_path",
+        type=str,
+        default=None,
+        help="Queue file of the download manager, used instead of --videos_parent_dir to extract the videos as soon as they are downloaded",
+    )
+    parser.add_argument(
+        "--delete_source",
+        action="store_true",
+        help="Delete every video once its frames are extracted (with --extraction_queue_path)",
+    )
     parser.add_argument(
         "--thumbnails_output_parent_dir",
         type=str,
@@ -160,7 +982,7 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--sampling_fps",
-        type=int,
+        type=float,
         default=60,
         help="Sampling rate in frames per second",
     )
@@ -171,12 +993,89 @@ if __name__ == "__main__":
         default=(320, 240),
         help="thumbnails_Resolution of the thumbnails",
     )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        default="npy",
+        choices=OUTPUT_FORMATS,
+        help="npy: frames packed in one array per video, jpg: one JPEG per frame (previews), both",
+    )
+    parser.add_argument(
+        "--sampling_mode",
+        type=str,
+        default="uniform",
+        choices=SAMPLING_MODES,
+        help="uniform: every 1 / sampling_fps seconds, scene: at scene changes (sampling_fps is then the maximum rate)",
+    )
+    parser.add_argument(
+        "--min_sampling_fps",
+        type=float,
+        default=1 / 30,
+        help="Minimum sampling rate during static stretches (with --sampling_mode scene)",
+    )
+    parser.add_argument(
+        "--scene_threshold",
+        type=float,
+        default=10,
+        help="Mean absolute difference (0-255) between downscaled frames from which a frame is kept (with --sampling_mode scene)",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="auto",
+        choices=BACKENDS,
+        help="Decoder: ffmpeg (scaling at decode time), opencv, or auto (ffmpeg if installed, falling back to opencv)",
+    )
+    parser.add_argument(
+        "--ffmpeg_threads",
+        type=int,
+        default=0,
+        help="Number of decoding threads of ffmpeg (0: chosen by ffmpeg)",
+    )
+    parser.add_argument(
+        "--ffmpeg_fast_decode",
+        action="store_true",
+        help="Skip the deblocking filter and the non-reference frames with ffmpeg (faster, but sampled frames may move to a neighbouring frame)",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help="Number of videos extracted in parallel (with --videos_parent_dir)",
+    )
 
     args = parser.parse_args()
 
-    extract_frames_every_n_seconds_dir(
-        videos_parent_dir=args.videos_parent_dir,
-        thumbnails_output_parent_dir=args.thumbnails_output_parent_dir,
-        sampling_fps=args.sampling_fps,
-        thumbnails_resolution=tuple(args.thumbnails_resolution),
-    )
+    if (args.videos_parent_dir is None) == (args.extraction_queue_path is None):
+        parser.error("exactly one of --videos_parent_dir and --extraction_queue_path is required")
+
+    if args.extraction_queue_path is not None:
+        extract_frames_from_queue(
+            extraction_queue_path=args.extraction_queue_path,
+            thumbnails_output_parent_dir=args.thumbnails_output_parent_dir,
+            sampling_fps=args.sampling_fps,
+            thumbnails_resolution=tuple(args.thumbnails_resolution),
+            delete_source=args.delete_source,
+            output_format=args.output_format,
+            sampling_mode=args.sampling_mode,
+            min_sampling_fps=args.min_sampling_fps,
+            scene_threshold=args.scene_threshold,
+            backend=args.backend,
+            ffmpeg_threads=args.ffmpeg_threads,
+            ffmpeg_fast_decode=args.ffmpeg_fast_decode,
+        )
+    else:
+        extract_frames_every_n_seconds_dir(
+            videos_parent_dir=args.videos_parent_dir,
+            thumbnails_output_parent_dir=args.thumbnails_output_parent_dir,
+            sampling_fps=args.sampling_fps,
+            thumbnails_resolution=tuple(args.thumbnails_resolution),
+            num_workers=args.num_workers,
+            output_format=args.output_format,
+            sampling_mode=args.sampling_mode,
+            min_sampling_fps=args.min_sampling_fps,
+            scene_threshold=args.scene_threshold,
+            backend=args.backend,
+            ffmpeg_threads=args.ffmpeg_threads,
+            ffmpeg_fast_decode=args.ffmpeg_fast_decode,
+        )
@@ -11,9 +11,10 @@ from torch import optim
 from .configs.default import get_cfg_defaults
 from .models.blocks import FACT
 from .models.loss import MatchCriterion
-from .utils.dataset import DataLoader, create_dataset
+from .utils.dataset import VIDEO_CACHE, DataLoader, create_dataset
 from .utils.evaluate import Checkpoint
 from .utils.train_tools import compute_null_weight, save_results
+from .utils.utils import segments_to_seconds
 
 
 def evaluate(global_step, net, testloader):
@@ -29,13 +30,14 @@ def evaluate(global_step, net, testloader):
     with torch.no_grad():
         for vnames, seq_list, train_label_list, eval_label_list in testloader:
 
-            seq_list = [s.to(device) for s in seq_list]
-            train_label_list = [s.to(device) for s in train_label_list]
+            seq_list = [s.to(device, non_blocking=True) for s in seq_list]
+            train_label_list = [s.to(device, non_blocking=True) for s in train_label_list]
             video_saves = net(seq_list, train_label_list)
             save_results(ckpt, vnames, eval_label_list, video_saves)
 
     net.train()
     ckpt.compute_metrics()
+    print(VIDEO_CACHE)
 
     return ckpt
 
@@ -135,7 +137,13 @@ def infer(
             cfg, cfg.eval_thumbnails_dir, cfg.eval_groundtruth_dir, cfg.eval_video_list
         )
         dataloader = DataLoader(
-            dataset, batch_size=cfg.batch_size, shuffle=False)
+            dataset,
+            batch_size=cfg.batch_size,
+            shuffle=False,
+            num_workers=cfg.num_workers,
+            prefetch_batches=cfg.prefetch_batches,
+            pin_memory=cfg.pin_memory,
+        )
 
         ####################################
         # Network
@@ -166,8 +174,8 @@ def infer(
         with torch.no_grad():
             for vnames, seq_list, train_label_list, eval_label_list in dataloader:
 
-                seq_list = [s.to(device) for s in seq_list]
-                train_label_list = [s.to(device) for s in train_label_list]
+                seq_list = [s.to(device, non_blocking=True) for s in seq_list]
+                train_label_list = [s.to(device, non_blocking=True) for s in train_label_list]
                 video_saves = net(seq_list, train_label_list)
                 save_results(ckpt, vnames, eval_label_list, video_saves)
 
@@ -177,6 +185,14 @@ def infer(
                     if groundtruth_dir is not None:
                         local_results["groundtruth"] = eval_label_list[i]
                     local_results["predictions"] = video_saves[i]["pred"].tolist()
+
+                    # Map the predictions back to the time of the video
+                    timestamps = dataset.get_timestamps(vname)
+                    if timestamps is not None:
+                        local_results["timestamps_secs"] = timestamps.tolist()
+                        local_results["predicted_segments_secs"] = segments_to_seconds(
+                            local_results["predictions"], timestamps
+                        )
                     video_results[vname] = local_results
 
         ####################################
@@ -279,9 +295,22 @@ def initialise_training(cfg_path: str, **kwargs):
     test_dataset = create_dataset(
         cfg, cfg.thumbnails_dir, cfg.groundtruth_dir, cfg.test_video_list
     )
-    trainloader = DataLoader(dataset, batch_size=cfg.batch_size, shuffle=True)
+    trainloader = DataLoader(
+        dataset,
+        batch_size=cfg.batch_size,
+        shuffle=True,
+        num_workers=cfg.num_workers,
+        prefetch_batches=cfg.prefetch_batches,
+        pin_memory=cfg.pin_memory,
+    )
     testloader = DataLoader(
-        test_dataset, batch_size=cfg.batch_size, shuffle=False)
+        test_dataset,
+        batch_size=cfg.batch_size,
+        shuffle=False,
+        num_workers=cfg.num_workers,
+        prefetch_batches=cfg.prefetch_batches,
+        pin_memory=cfg.pin_memory,
+    )
 
     ####################################
     # Save configuration file
@@ -333,8 +362,8 @@ def initialise_training(cfg_path: str, **kwargs):
 
         for vnames, seq_list, train_label_list, eval_label_list in trainloader:
 
-            seq_list = [s.to(device) for s in seq_list]
-            train_label_list = [s.to(device) for s in train_label_list]
+            seq_list = [s.to(device, non_blocking=True) for s in seq_list]
+            train_label_list = [s.to(device, non_blocking=True) for s in train_label_list]
             loss, video_saves = net(
                 seq_list, train_label_list, compute_loss=True)
             loss.backward()
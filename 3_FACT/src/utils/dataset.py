@@ -1,10 +1,18 @@
 #!/usr/bin/python3
 
 import cv2
+import hashlib
+import json
 import numpy as np
 import os
+import shutil
+import threading
 import torch
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from ..dimensionality_reduction import load_reduction
 from ..home import get_project_base
+from ..thumbnails_extractor import FRAME_INDEX_FILE_NAME, PACKED_FRAMES_FILE_NAME, read_manifest
 from yacs.config import CfgNode
 from .utils import shrink_frame_label
 
@@ -22,10 +30,20 @@ def load_feature(feature_dir, video, transpose):
     
     return feature #[::sample_rate]
 
-def load_thumbnails(thumbnails_parent_dir, video_id, transpose):
+def read_thumbnails(thumbnails_parent_dir, video_id):
+    """
+    Flattened uint8 frames (frames x dimension) of a video, memory-mapped for packed frames
+    """
+
+    # Frames packed by thumbnails_extractor.py (--output_format npy)
+    packed_frames_path = f"{thumbnails_parent_dir}/{video_id}/{PACKED_FRAMES_FILE_NAME}"
+    if os.path.exists(packed_frames_path):
+        frames = np.load(packed_frames_path, mmap_mode='r')
+        return frames.reshape(frames.shape[0], -1)
 
     # Get list of thumbnails in specific directory
-    thumbnails = os.listdir(f"{thumbnails_parent_dir}/{video_id}")
+    # (skipping the manifest written by thumbnails_extractor.py)
+    thumbnails = [f for f in os.listdir(f"{thumbnails_parent_dir}/{video_id}") if f.endswith(".jpg")]
     thumbnails.sort()
     
     # For each thumbnail, read and append to array
@@ -34,7 +52,12 @@ def load_thumbnails(thumbnails_parent_dir, video_id, transpose):
         thumbnail_path = f"{thumbnails_parent_dir}/{video_id}/{thumbnail}"
         thumbnail_array = cv2.imread(thumbnail_path)
         thumbnails_array.append(thumbnail_array.flatten())
-    thumbnails_array = np.array(thumbnails_array)
+
+    return np.array(thumbnails_array)
+
+def load_thumbnails(thumbnails_parent_dir, video_id, transpose):
+
+    thumbnails_array = read_thumbnails(thumbnails_parent_dir, video_id)
 
     # Transpose if ncessary
     if transpose:
@@ -46,6 +69,173 @@ def load_thumbnails(thumbnails_parent_dir, video_id, transpose):
 
     return thumbnails_array
 
+def probe_feature(feature_dir, video):
+    """
+    Shape and dtype of the features of a video, from the .npy header
+    """
+
+    feature = np.load(os.path.join(feature_dir, video+'.npy'), mmap_mode='r')
+    return feature.shape, feature.dtype
+
+def probe_thumbnails(thumbnails_parent_dir, video_id):
+    """
+    Shape (frames x dimension) and dtype of read_thumbnails(thumbnails_parent_dir, video_id),
+    from the .npy header of the packed frames, the manifest or a single thumbnail
+    """
+
+    packed_frames_path = f"{thumbnails_parent_dir}/{video_id}/{PACKED_FRAMES_FILE_NAME}"
+    if os.path.exists(packed_frames_path):
+        frames = np.load(packed_frames_path, mmap_mode='r')
+        return (frames.shape[0], int(np.prod(frames.shape[1:]))), frames.dtype
+
+    manifest = read_manifest(f"{thumbnails_parent_dir}/{video_id}")
+    if manifest is not None and "thumbnails_resolution" in manifest and "nb_frames" in manifest:
+        width, height = manifest["thumbnails_resolution"]
+        return (manifest["nb_frames"], width * height * 3), np.dtype(np.uint8)
+
+    thumbnails = sorted(f for f in os.listdir(f"{thumbnails_parent_dir}/{video_id}") if f.endswith(".jpg"))
+    thumbnail_array = cv2.imread(f"{thumbnails_parent_dir}/{video_id}/{thumbnails[0]}")
+    return (len(thumbnails), thumbnail_array.size), thumbnail_array.dtype
+
+def load_timestamps(thumbnails_parent_dir, video_id):
+    """
+    Timestamps (in seconds) of the frames of a video, from the index written by
+    thumbnails_extractor.py, or None for thumbnails extracted without an index
+    """
+
+    frame_index_path = f"{thumbnails_parent_dir}/{video_id}/{FRAME_INDEX_FILE_NAME}"
+    if not os.path.exists(frame_index_path):
+        # Index copied next to the features by feature_encoder.py
+        frame_index_path = f"{thumbnails_parent_dir}/{video_id}.{FRAME_INDEX_FILE_NAME}"
+    if not os.path.exists(frame_index_path):
+        return None
+    frame_index = np.loadtxt(frame_index_path, delimiter=',', skiprows=1, ndmin=2)
+    return frame_index[:, 1]
+
+
+class FeatureCache(object):
+    """
+    Memory-mapped copies of the features of every video, built on first access so that
+    the thumbnails are decoded once instead of every epoch.
+
+    Entries are stored in {cache_dir}/{key of the source}/{video}-{key of the video}.npy:
+    the source key hashes the source directory and the extra key parts (e.g. the reduction
+    applied to the frames), the video key the modification time of the source of the video,
+    so an entry is rebuilt (and the stale one removed) whenever its source changes.
+    """
+
+    def __init__(self, cache_dir, source_dir, key_parts=()):
+        source_key = "|".join([os.path.realpath(source_dir)] + [str(part) for part in key_parts])
+        self.cache_dir = f"{cache_dir}/{hashlib.sha1(source_key.encode('utf-8')).hexdigest()[:16]}"
+
+    def get_cache_path(self, video, source_path):
+        video_key = f"{video}|{os.stat(source_path).st_mtime_ns}"
+        return f"{self.cache_dir}/{video}-{hashlib.sha1(video_key.encode('utf-8')).hexdigest()[:16]}.npy"
+
+    def load(self, video, source_path, build_func):
+        """
+        Features of the video (memory-mapped, read-only), built with build_func() on a miss
+        """
+
+        cache_path = self.get_cache_path(video, source_path)
+        if not os.path.exists(cache_path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            # Remove the entries of previous versions of the video
+            for file_name in os.listdir(self.cache_dir):
+                if (
+                    file_name.startswith(f"{video}-") and len(file_name) == len(video) + 21 and file_name.endswith(".npy")
+                    and file_name != os.path.basename(cache_path)
+                ):
+                    try:
+                        os.remove(f"{self.cache_dir}/{file_name}")
+                    except FileNotFoundError:
+                        pass
+
+            # Unique per thread, as the loaders can build the same video concurrently
+            temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as file:
+                np.save(file, build_func())
+            os.replace(temp_path, cache_path)
+
+        return np.load(cache_path, mmap_mode='r')
+
+
+class VideoCache(object):
+    """
+    Least recently used cache of loaded videos (outputs of load_video), within a budget of
+    max_bytes, shared by every Dataset of the process (see VIDEO_CACHE) so that the train
+    and test datasets, and the evaluation every eval_every epochs, do not reload videos.
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return "< VideoCache %d videos, %.2f / %.2f GB, %d hits, %d misses, %d evictions >" % (
+            len(self.entries), self.nbytes / 1e9, self.max_bytes / 1e9, self.hits, self.misses, self.evictions
+        )
+
+    @staticmethod
+    def get_size(video):
+        feature, train_label, eval_label = video
+        return feature.nbytes + 8 * (len(train_label) + len(eval_label))
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.evict()
+
+    def evict(self):
+        while self.nbytes > self.max_bytes:
+            _, video = self.entries.popitem(last=False)
+            self.nbytes -= self.get_size(video)
+            self.evictions += 1
+
+    @staticmethod
+    def copy(video):
+        # Entries are shared by every access, and the model modifies its inputs in place
+        # (e.g. time masking): only copies of them are handed out
+        feature, train_label, eval_label = video
+        return feature.copy(), list(train_label), list(eval_label)
+
+    def get(self, key, load_func):
+        """
+        Video of the given key, loaded with load_func() on a miss.
+        Cached videos are copied, videos too large for the cache are returned as loaded.
+        """
+
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.copy(self.entries[key])
+            self.misses += 1
+
+        # Loaded outside of the lock, so that the loader threads load videos concurrently
+        video = load_func()
+        size = self.get_size(video)
+        if size > self.max_bytes:
+            return video
+
+        video[0].setflags(write=False)
+        with self.lock:
+            if key in self.entries:
+                return self.copy(self.entries[key])
+            self.entries[key] = video
+            self.nbytes += size
+            self.evict()
+        return self.copy(video)
+
+
+VIDEO_CACHE = VideoCache()
+
 
 class Dataset(object):
     """
@@ -54,18 +244,24 @@ class Dataset(object):
     self.n_classes: number of classes
     """
 
-    def __init__(self, video_list, nclasses, load_video_func, bg_class):
+    def __init__(self, video_list, nclasses, load_video_func, bg_class, cache_key=None, input_dimension=None):
         """
+        cache_key: identifies the loading parameters of load_video_func in VIDEO_CACHE
+                   (None: videos are not cached)
+        input_dimension: dimension of the features, if known without loading a video
         """
 
         self.video_list = video_list
         self.load_video = load_video_func
+        self.cache_key = cache_key
 
         # store dataset information
         self.nclasses = nclasses
         self.bg_class = bg_class
         self.data = {}
-        self.input_dimension = load_video_func(video_list[0])[0].shape[1] 
+        if input_dimension is None:
+            input_dimension = self[video_list[0]][0].shape[1]
+        self.input_dimension = input_dimension
     
     def __str__(self):
         string = "< Dataset %d videos, %d feat-size, %d classes >"
@@ -82,20 +278,34 @@ class Dataset(object):
         if video not in self.video_list:
             raise ValueError(video)
 
-        return self.load_video(video)
+        if self.cache_key is None or VIDEO_CACHE.max_bytes <= 0:
+            return self.load_video(video)
+        return VIDEO_CACHE.get((self.cache_key, video), lambda: self.load_video(video))
 
     def __len__(self):
         return len(self.video_list)
 
 class DataLoader():
+    """
+    Iterate over batches of (vnames, seq_list, train_label_list, eval_label_list).
 
-    def __init__(self, dataset: Dataset, batch_size, shuffle=False):
+    With num_workers > 0, the videos of the next prefetch_batches batches are loaded by a
+    pool of threads while the current batch is used, so loading overlaps with the
+    forward/backward passes (decoding and memory-mapped reads release the GIL).
+    With pin_memory, the sequences are copied to page-locked memory by the workers, so
+    that seq.to(device, non_blocking=True) is asynchronous.
+    """
+
+    def __init__(self, dataset: Dataset, batch_size, shuffle=False, num_workers=0, prefetch_batches=2, pin_memory=False):
 
         self.num_video = len(dataset)
         self.dataset = dataset
         self.videos = list(dataset.get_vnames())
         self.shuffle = shuffle
         self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.prefetch_batches = max(prefetch_batches, 1)
+        self.pin_memory = pin_memory and torch.cuda.is_available()
 
         self.num_batch = int(np.ceil(self.num_video/self.batch_size))
 
@@ -105,33 +315,59 @@ class DataLoader():
             np.random.shuffle(self.selector)
             # self.selector = self.selector.tolist()
 
+        # Batches being loaded: (videos, futures), in the order of the selector
+        self.executor = ThreadPoolExecutor(num_workers) if num_workers > 0 else None
+        self.pending = deque()
+        self.next_index = 0
+
     def __len__(self):
         return self.num_batch
 
     def __iter__(self):
         return self
 
+    def get_batch_videos(self, index):
+        video_idx = self.selector[index : index+self.batch_size]
+        if len(video_idx) < self.batch_size:
+            video_idx = video_idx + self.selector[:self.batch_size-len(video_idx)]
+        return [self.videos[i] for i in video_idx]
+
+    def load_video(self, vname):
+        sequence, train_label, eval_label = self.dataset[vname]
+        sequence, train_label = torch.from_numpy(sequence), torch.LongTensor(train_label)
+        if self.pin_memory:
+            sequence, train_label = sequence.pin_memory(), train_label.pin_memory()
+        return sequence, train_label, eval_label
+
     def __next__(self):
         if self.index >= self.num_video:
             if self.shuffle:
                 np.random.shuffle(self.selector)
             self.index = 0
+            self.next_index = 0
+            self.pending.clear()
             raise StopIteration
 
         else:
-            video_idx = self.selector[self.index : self.index+self.batch_size]
-            if len(video_idx) < self.batch_size:
-                video_idx = video_idx + self.selector[:self.batch_size-len(video_idx)]
-            videos = [self.videos[i] for i in video_idx]
+            if self.executor is None:
+                videos = self.get_batch_videos(self.index)
+                loaded_videos = [self.load_video(vname) for vname in videos]
+            else:
+                # Keep prefetch_batches batches loading (within the epoch, as the next shuffle is unknown)
+                while len(self.pending) < self.prefetch_batches and self.next_index < self.num_video:
+                    next_videos = self.get_batch_videos(self.next_index)
+                    self.pending.append((next_videos, [self.executor.submit(self.load_video, vname) for vname in next_videos]))
+                    self.next_index += self.batch_size
+                videos, futures = self.pending.popleft()
+                loaded_videos = [future.result() for future in futures]
             self.index += self.batch_size
 
             batch_sequence = []
             batch_train_label = []
             batch_eval_label = []
-            for vname in videos:
-                sequence, train_label, eval_label = self.dataset[vname]
-                batch_sequence.append(torch.from_numpy(sequence))
-                batch_train_label.append(torch.LongTensor(train_label))
+            for sequence, train_label, eval_label in loaded_videos:
+                batch_sequence.append(sequence)
+                batch_train_label.append(train_label)
                 batch_eval_label.append(eval_label)
 
             return videos, batch_sequence, batch_train_label, batch_eval_label
@@ -158,6 +394,106 @@ def get_label_dictionaries(groundtruth_dir):
         return label2index, index2label
 
 
+LABEL_VOCABULARY_FILE_NAME = "vocabulary.txt"
+LABEL_INDEX_FILE_NAME = "index.json"
+
+def get_groundtruth_index(groundtruth_dir):
+    """
+    Size and modification time of every groundtruth file (stat only, no read)
+    """
+    index = {}
+    for groundtruth_file in sorted(os.listdir(groundtruth_dir)):
+        stat = os.stat(f"{groundtruth_dir}/{groundtruth_file}")
+        index[groundtruth_file] = [stat.st_size, stat.st_mtime_ns]
+    return index
+
+def compile_label_store(groundtruth_dir, label_store_dir):
+    """
+    Compile the groundtruth .txt files (one label per frame) into a label store:
+        - vocabulary.txt: one label per line, the line number being the index ("NIL" = 0)
+        - {video}.npy: int16 label of every frame, or, when it is at least 4 times smaller,
+          {video}.segments.npy: int32 (segments x 2) run-length encoding [label, nb_frames]
+        - index.json: size and modification time of the groundtruth files compiled
+
+    The vocabulary is built like get_label_dictionaries, in sorted file order and order of
+    first appearance, so that the indices do not depend on the listing or hashing order.
+    """
+
+    index = get_groundtruth_index(groundtruth_dir)
+    temp_dir = f"{label_store_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+
+    label2index = {"NIL": 0}
+    for groundtruth_file in index.keys():
+        with open(f"{groundtruth_dir}/{groundtruth_file}",'r') as file:
+            lines = file.read().split("\n")
+        for label in lines:
+            if label not in label2index and label != '':
+                label2index[label] = len(label2index)
+
+        if not groundtruth_file.endswith(".txt"):
+            continue
+
+        # Same parsing as the text files in load_video (last line ends with a new line)
+        labels = np.array([label2index[line] for line in lines[:-1]], dtype=np.int16)
+        video = groundtruth_file[:-len(".txt")]
+        boundaries = np.flatnonzero(np.diff(labels)) + 1
+        segments_nbytes = (len(boundaries) + 1) * 2 * np.dtype(np.int32).itemsize
+        if 4 * segments_nbytes <= labels.nbytes:
+            starts = np.concatenate([[0], boundaries])
+            lengths = np.diff(np.concatenate([starts, [len(labels)]]))
+            np.save(f"{temp_dir}/{video}.segments.npy", np.stack([labels[starts], lengths], axis=1).astype(np.int32))
+        else:
+            np.save(f"{temp_dir}/{video}.npy", labels)
+
+    with open(f"{temp_dir}/{LABEL_VOCABULARY_FILE_NAME}", "w", encoding="utf-8") as file:
+        file.write("".join(f"{label}\n" for label in label2index.keys()))
+    with open(f"{temp_dir}/{LABEL_INDEX_FILE_NAME}", "w", encoding="utf-8") as file:
+        json.dump(index, file)
+
+    shutil.rmtree(label_store_dir, ignore_errors=True)
+    os.replace(temp_dir, label_store_dir)
+
+def load_label_store(groundtruth_dir, label_store_parent_dir):
+    """
+    Label store of the groundtruth directory ({label_store_parent_dir}/{key of the directory}),
+    compiled on first use and again when a groundtruth file is added, removed or modified.
+
+    [Returns]
+            label_store_dir, label2index, index2label
+    """
+
+    key = hashlib.sha1(os.path.realpath(groundtruth_dir).encode("utf-8")).hexdigest()[:16]
+    label_store_dir = f"{label_store_parent_dir}/{key}"
+
+    index_path = f"{label_store_dir}/{LABEL_INDEX_FILE_NAME}"
+    index = None
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as file:
+            index = json.load(file)
+    if index != get_groundtruth_index(groundtruth_dir):
+        os.makedirs(label_store_parent_dir, exist_ok=True)
+        compile_label_store(groundtruth_dir, label_store_dir)
+
+    with open(f"{label_store_dir}/{LABEL_VOCABULARY_FILE_NAME}", "r", encoding="utf-8") as file:
+        label2index = {label: i for i, label in enumerate(file.read().split("\n")[:-1])}
+    index2label = dict((v,k) for k,v in label2index.items())
+
+    return label_store_dir, label2index, index2label
+
+def load_labels(label_store_dir, video):
+    """
+    Label index of every frame of a video from the label store (int16 array)
+    """
+
+    labels_path = f"{label_store_dir}/{video}.npy"
+    if os.path.exists(labels_path):
+        return np.load(labels_path, mmap_mode='r')
+    segments = np.load(f"{label_store_dir}/{video}.segments.npy", mmap_mode='r')
+    return np.repeat(segments[:, 0].astype(np.int16), segments[:, 1])
+
+
 def create_dataset(cfg: CfgNode, thumbnails_dir:str, groundtruth_dir:str, video_list:list[str]):
 
     # Default parameters
@@ -165,11 +501,58 @@ def create_dataset(cfg: CfgNode, thumbnails_dir:str, groundtruth_dir:str, video_
     average_transcript_len = 2.0
     bg_class = [0] 
 
+    if cfg.feature_type not in ["thumbnails", "npy"]:
+        raise ValueError(f"feature_type has to be 'thumbnails' or 'npy', not {cfg.feature_type}")
+
+    # Projection of the raw pixels fitted by dimensionality_reduction.py
+    reduction = None
+    if cfg.feature_type == "thumbnails" and cfg.reduction_path is not None:
+        reduction = load_reduction(cfg.reduction_path)
+
+    # Decoded thumbnails stored as uint8 (float32 once reduced) and memory-mapped in later epochs.
+    # Packed frames without reduction are memory-mapped directly and need no cache.
+    feature_cache = None
+    if cfg.feature_type == "thumbnails" and cfg.feature_cache_dir is not None:
+        cache_dir = cfg.feature_cache_dir
+        if not os.path.isabs(cache_dir):
+            cache_dir = os.path.join(get_project_base(), cache_dir)
+        key_parts = []
+        if reduction is not None:
+            key_parts = [os.path.realpath(cfg.reduction_path), os.stat(cfg.reduction_path).st_mtime_ns]
+        feature_cache = FeatureCache(cache_dir, thumbnails_dir, key_parts)
+
+    def load_frames(vname):
+        """
+        Features of a video before transpose, labels and down-sampling, in their storage type
+        """
+        frames = read_thumbnails(thumbnails_dir, vname)
+        if reduction is not None:
+            frames = reduction.transform(frames)
+        return frames
+
+    def load_cached_frames(vname):
+        packed_frames_path = f"{thumbnails_dir}/{vname}/{PACKED_FRAMES_FILE_NAME}"
+        if os.path.exists(packed_frames_path):
+            if reduction is None:
+                return read_thumbnails(thumbnails_dir, vname)
+            source_path = packed_frames_path
+        else:
+            # Adding or removing a JPEG updates the modification time of its directory
+            source_path = f"{thumbnails_dir}/{vname}"
+        return feature_cache.load(vname, source_path, lambda: load_frames(vname))
+
     ################################################
 
+    label_store_dir = None
     if groundtruth_dir == None:
         label2index, index2label = None, None 
         nclasses = cfg.nclasses
+    elif cfg.label_store_dir is not None:
+        label_store_parent_dir = cfg.label_store_dir
+        if not os.path.isabs(label_store_parent_dir):
+            label_store_parent_dir = os.path.join(get_project_base(), label_store_parent_dir)
+        label_store_dir, label2index, index2label = load_label_store(groundtruth_dir, label_store_parent_dir)
+        nclasses = len(label2index)
     else:
         label2index, index2label = get_label_dictionaries(groundtruth_dir)
         nclasses = len(label2index)
@@ -181,16 +564,29 @@ def create_dataset(cfg: CfgNode, thumbnails_dir:str, groundtruth_dir:str, video_
             Output:
                 feature, label_for_training, label_for_evaluation
         """
-        feature = load_thumbnails(thumbnails_dir, vname, feature_transpose)
+        if cfg.feature_type == "npy":
+            feature = load_feature(thumbnails_dir, vname, feature_transpose)
+        elif feature_cache is not None:
+            feature = load_cached_frames(vname)
+            if feature_transpose:
+                feature = feature.T
+        else:
+            feature = load_thumbnails(thumbnails_dir, vname, feature_transpose)
+            if reduction is not None:
+                feature = reduction.transform(feature)
 
         # Handle in the case of infer only
         if groundtruth_dir == None:
             nb_frames = int(feature.shape[0])
+            feature = np.ascontiguousarray(feature, dtype=np.float32)
             return feature, [0 for i in range(nb_frames)],  [0 for i in range(nb_frames)]
 
         # Otherwise, process the ground truth
-        with open(os.path.join(groundtruth_dir, vname + '.txt')) as f:
-            gt_label = [ label2index[line] for line in f.read().split('\n')[:-1] ]
+        if label_store_dir is not None:
+            gt_label = load_labels(label_store_dir, vname).tolist()
+        else:
+            with open(os.path.join(groundtruth_dir, vname + '.txt')) as f:
+                gt_label = [ label2index[line] for line in f.read().split('\n')[:-1] ]
 
         if feature.shape[0] != len(gt_label):
             l = min(feature.shape[0], len(gt_label))
@@ -205,11 +601,52 @@ def create_dataset(cfg: CfgNode, thumbnails_dir:str, groundtruth_dir:str, video_
         else:
             gt_label_sampled = gt_label
 
+        # Only the frames kept are copied out of the memory-mapped cache
+        feature = np.ascontiguousarray(feature, dtype=np.float32)
+
         return feature, gt_label_sampled, gt_label
 
     
+    def probe_input_dimension(vname):
+        """
+        Dimension of the features returned by load_video, without loading the frames
+        """
+        if cfg.feature_type == "npy":
+            shape, _ = probe_feature(thumbnails_dir, vname)
+        elif reduction is not None:
+            return reduction.n_components
+        else:
+            shape, _ = probe_thumbnails(thumbnails_dir, vname)
+        return shape[0] if feature_transpose else shape[1]
+
+    def get_timestamps(vname):
+        """
+        Timestamps (in seconds) of the frames returned by load_video (None if unknown),
+        to map predictions back to the time of the video (e.g. with scene sampling)
+        """
+        timestamps = load_timestamps(thumbnails_dir, vname)
+
+        # Down-sampled like the frames (only with a ground truth, see load_video)
+        if timestamps is not None and groundtruth_dir is not None and cfg.sr > 1:
+            timestamps = timestamps[::cfg.sr]
+        return timestamps
+
     ################################################
-    dataset = Dataset(video_list, nclasses, load_video, bg_class)    
+    # Datasets loading videos the same way share their entries in the in-RAM cache
+    VIDEO_CACHE.set_max_bytes(cfg.video_cache_gb * 1e9)
+    cache_key = (
+        os.path.realpath(thumbnails_dir),
+        None if groundtruth_dir is None else os.path.realpath(groundtruth_dir),
+        label_store_dir,
+        cfg.feature_type,
+        cfg.reduction_path,
+        cfg.sr,
+    )
+
+    dataset = Dataset(
+        video_list, nclasses, load_video, bg_class, cache_key, probe_input_dimension(video_list[0])
+    )
+    dataset.get_timestamps = get_timestamps
     dataset.average_transcript_len = average_transcript_len
     dataset.label2index = label2index
     dataset.index2label = index2label
@@ -84,6 +84,22 @@ def shrink_frame_label(label: list, clip_len: int) -> list:
 
     return new_label
 
+def segments_to_seconds(label, timestamps) -> list:
+    """
+    map the segments of a frame label to the time of the video
+    return [[action, start_secs, end_secs], ...], a segment ending where the next one starts
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    n = min(len(label), len(timestamps))
+    if n == 0:
+        return []
+
+    segments = []
+    for seg in parse_label(np.asarray(label)[:n]):
+        end = timestamps[seg.end + 1] if seg.end + 1 < n else timestamps[n - 1]
+        segments.append([int(seg.action), float(timestamps[seg.start]), float(end)])
+    return segments
+
 def easy_reduce(scores, mode="mean", skip_nan=False):
     assert isinstance(scores, list), type(scores)
 
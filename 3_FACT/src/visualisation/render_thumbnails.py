@@ -1,10 +1,14 @@
 import argparse
 import json
 import os
+import numpy as np
 from PIL import Image, ImageDraw
 from reportlab.pdfgen import canvas
 from tqdm import tqdm
 
+# Frames packed by thumbnails_extractor.py (--output_format npy, its default), BGR uint8
+PACKED_FRAMES_FILE_NAME = "frames.npy"
+
 def load_data(results_json_path:str, video_id:str):
 
 	with open(results_json_path,'r') as file:
@@ -23,9 +27,19 @@ def render_results(video_id:str,
 	# Parse argument
 	thumbnails_dir = f'{thumbnails_parent_dir}/{video_id}'
 
-	# Load thumbnails
-	thumbnails_path = os.listdir(thumbnails_dir)
+	# Load thumbnails (JPEGs, or else the packed frames)
+	thumbnails_path = [f for f in os.listdir(thumbnails_dir) if f.endswith('.jpg')]
 	thumbnails_path.sort()
+	packed_frames_path = f"{thumbnails_dir}/{PACKED_FRAMES_FILE_NAME}"
+	if len(thumbnails_path) > 0:
+		nb_thumbnails = len(thumbnails_path)
+		load_thumbnail = lambda idx: Image.open(f"{thumbnails_dir}/{thumbnails_path[idx]}")
+	elif os.path.exists(packed_frames_path):
+		frames = np.load(packed_frames_path, mmap_mode='r')
+		nb_thumbnails = len(frames)
+		load_thumbnail = lambda idx: Image.fromarray(np.ascontiguousarray(frames[idx][..., ::-1]))
+	else:
+		raise FileNotFoundError(f"No thumbnails (.jpg or {PACKED_FRAMES_FILE_NAME}) in {thumbnails_dir}")
 
 	# Load prediction results
 	pred = load_data(results_json_path, video_id)
@@ -36,7 +50,7 @@ def render_results(video_id:str,
 	vertical_spacing = 40
 	horizontal_spacing = 20
 
-	num_rows = len(thumbnails_path) // num_cols + 1
+	num_rows = nb_thumbnails // num_cols + 1
 	image_width, image_height = thumbnails_render_resolution
 	grid_width = side_margin + num_cols * (image_width + horizontal_spacing) 
 	grid_height = top_margin + num_rows * (image_height + vertical_spacing)
@@ -46,8 +60,8 @@ def render_results(video_id:str,
 	draw = ImageDraw.Draw(grid_image)
 
 	# Place images in the grid
-	for idx, image_path in enumerate(thumbnails_path):
-		img = Image.open(f"{thumbnails_dir}/{image_path}")
+	for idx in range(nb_thumbnails):
+		img = load_thumbnail(idx)
 		img = img.resize(thumbnails_render_resolution)
 		row = idx // num_cols
 		col = idx % num_cols